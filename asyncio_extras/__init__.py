@@ -1,5 +1,8 @@
 from .asyncyield import *  # noqa
 from .contextmanager import *  # noqa
+from .executors import *  # noqa
 from .file import *  # noqa
 from .generator import *  # noqa
+from .instrumentation import *  # noqa
+from .processes import *  # noqa
 from .threads import *  # noqa
@@ -1,7 +1,9 @@
+from asyncio import CancelledError, ensure_future, gather, get_event_loop, wait
+from collections import deque
 from collections.abc import Coroutine
-from functools import wraps
-from inspect import iscoroutinefunction
-from typing import Callable, Union
+from functools import partial, wraps
+from inspect import isawaitable, iscoroutinefunction
+from typing import Callable, Iterable, List, Union
 
 from async_generator import async_generator, isasyncgenfunction
 
@@ -12,7 +14,8 @@ try:
 except ImportError:
     generator_types = Coroutine
 
-__all__ = ('async_contextmanager',)
+__all__ = ('async_contextmanager', 'pooled_async_contextmanager', 'AsyncResourcePool',
+           'ConcurrentExitStack')
 
 
 class _AsyncContextManager:
@@ -89,3 +92,553 @@ def async_contextmanager(func: Callable[..., generator_types]) -> Callable:
         return _AsyncContextManager(generator)
 
     return wrapper
+
+
+class _PooledResource:
+    __slots__ = 'generator', 'value', 'last_used'
+
+    def __init__(self, generator, value) -> None:
+        self.generator = generator
+        self.value = value
+        self.last_used = None
+
+
+class _Pool:
+    __slots__ = ('factory', 'min_size', 'max_size', 'idle_ttl', 'health_check', 'discard', 'size',
+                 'closed', '_idle', '_waiters', '_timer', '_acquiring')
+
+    def __init__(self, factory: Callable, min_size: int, max_size: int, idle_ttl, health_check,
+                 discard: Callable = None):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.health_check = health_check
+        self.discard = discard
+        self.size = 0
+        self.closed = False
+        self._idle = deque()  # type: deque
+        self._waiters = deque()  # type: deque
+        self._timer = None
+        self._acquiring = 0
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    async def acquire(self) -> _PooledResource:
+        # Keep the pool from being discarded while it's empty only because of a failed attempt
+        self._acquiring += 1
+        try:
+            while True:
+                if self.closed:
+                    raise RuntimeError('the resource pool has been closed')
+
+                entry = await self._checkout()
+                if entry is None:
+                    try:
+                        return await self._create()
+                    except BaseException:
+                        self._free_slot()
+                        raise
+
+                if self.health_check is not None:
+                    try:
+                        healthy = self.health_check(entry.value)
+                        if isawaitable(healthy):
+                            healthy = await healthy
+                    except BaseException:
+                        # Don't let a failing or cancelled check hold on to the slot
+                        await self.evict(entry)
+                        raise
+
+                    if not healthy:
+                        await self.evict(entry)
+                        continue
+
+                return entry
+        finally:
+            self._acquiring -= 1
+            self._discard_if_empty()
+
+    async def release(self, entry: _PooledResource) -> None:
+        if self.closed:
+            await self.evict(entry)
+            return
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(entry)
+                return
+
+        loop = get_event_loop()
+        entry.last_used = loop.time()
+        self._idle.append(entry)
+        if self.idle_ttl is not None and self._timer is None:
+            self._timer = loop.call_later(self.idle_ttl, self._evict_expired)
+
+    async def evict(self, entry: _PooledResource, exception: BaseException = None) -> bool:
+        try:
+            if exception is not None:
+                try:
+                    await entry.generator.athrow(exception)
+                except StopAsyncIteration:
+                    return True
+            else:
+                try:
+                    await entry.generator.asend(None)
+                except StopAsyncIteration:
+                    pass
+                else:
+                    raise RuntimeError("async generator didn't stop")
+        finally:
+            self._free_slot()
+
+        return False
+
+    async def aclose(self) -> None:
+        self.closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_exception(RuntimeError('the resource pool has been closed'))
+
+        self._waiters.clear()
+        while self._idle:
+            await self.evict(self._idle.pop())
+
+    async def _checkout(self):
+        # Returns an idle resource, or None if the caller has been granted a slot for creating a
+        # new one
+        if self._idle:
+            return self._idle.pop()
+
+        if self.size < self.max_size:
+            self.size += 1
+            return None
+
+        waiter = get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except CancelledError:
+            # Pass on whatever was handed to us before the cancellation took effect
+            if waiter.done() and not waiter.cancelled():
+                entry = waiter.result()
+                if entry is None:
+                    self._free_slot()
+                else:
+                    await self.release(entry)
+
+            raise
+
+    async def _create(self) -> _PooledResource:
+        generator = self.factory()
+        value = await generator.asend(None)
+        return _PooledResource(generator, value)
+
+    def _free_slot(self) -> None:
+        # Hand the slot over to the first waiter so that it can create a new resource
+        if not self.closed:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+
+        self.size -= 1
+        self._discard_if_empty()
+
+    def _discard_if_empty(self) -> None:
+        if self.size == 0 and not self._acquiring and self.discard is not None:
+            self.discard(self)
+
+    def _evict_expired(self) -> None:
+        self._timer = None
+        loop = get_event_loop()
+        deadline = loop.time() - self.idle_ttl
+        excess = self.size - self.min_size
+        while self._idle and excess > 0 and self._idle[0].last_used <= deadline:
+            entry = self._idle.popleft()
+            ensure_future(self._evict_in_background(entry))
+            excess -= 1
+
+        if self._idle and excess > 0:
+            delay = self._idle[0].last_used - deadline
+            self._timer = loop.call_later(delay, self._evict_expired)
+
+    async def _evict_in_background(self, entry: _PooledResource) -> None:
+        try:
+            await self.evict(entry)
+        except Exception as exc:
+            get_event_loop().call_exception_handler({
+                'message': 'Error tearing down an idle pooled resource',
+                'exception': exc
+            })
+
+
+class _PooledContextManager:
+    __slots__ = 'owner', 'key', 'args', 'kwargs', 'pool', 'entry'
+
+    def __init__(self, owner: 'AsyncResourcePool', key, args, kwargs) -> None:
+        self.owner = owner
+        self.key = key
+        self.args = args
+        self.kwargs = kwargs
+        self.pool = None
+        self.entry = None
+
+    async def __aenter__(self):
+        # The pool is looked up only now, as empty pools are discarded
+        self.pool = self.owner._get_pool(self.key, self.args, self.kwargs)
+        self.entry = await self.pool.acquire()
+        return self.entry.value
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        entry, self.entry = self.entry, None
+        if exc_val is not None:
+            return await self.pool.evict(entry, exc_val)
+        else:
+            await self.pool.release(entry)
+
+
+class AsyncResourcePool:
+    """
+    A pool of resources produced by an async generator function.
+
+    Instances of this class are created by :func:`pooled_async_contextmanager`. Calling one
+    returns an asynchronous context manager that checks out a resource for the duration of the
+    ``async with`` block. Each distinct set of arguments, which must be hashable, gets a pool of
+    its own. A pool is discarded once it holds no resources.
+
+    :ivar int min_size: number of resources per pool that idle eviction leaves in place (resources
+        are not created in advance to reach it)
+    :ivar int max_size: maximum number of resources per pool, in use or idle
+    :ivar float idle_ttl: seconds a resource may stay idle before it is torn down (``None`` to
+        keep idle resources indefinitely)
+    :ivar health_check: callable (or coroutine function) called with a resource on checkout that
+        returns a falsy value if the resource should be torn down and replaced
+    """
+
+    __slots__ = ('__wrapped__', 'min_size', 'max_size', 'idle_ttl', 'health_check', '_pools',
+                 '_closed')
+
+    def __init__(self, func: Callable, min_size: int = 0, max_size: int = 10,
+                 idle_ttl: float = None, health_check: Callable = None) -> None:
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if min_size < 0 or min_size > max_size:
+            raise ValueError('min_size must be between 0 and max_size')
+
+        self.__wrapped__ = func
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.health_check = health_check
+        self._pools = {}
+        self._closed = False
+
+    def __call__(self, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError('the resource pool has been closed')
+
+        key = (args, frozenset(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError as exc:
+            raise TypeError('the arguments of pooled resources must be hashable ({})'
+                            .format(exc)) from None
+
+        return _PooledContextManager(self, key, args, kwargs)
+
+    def _get_pool(self, key, args, kwargs) -> _Pool:
+        pool = self._pools.get(key)
+        if pool is None:
+            if self._closed:
+                raise RuntimeError('the resource pool has been closed')
+
+            factory = partial(self.__wrapped__, *args, **kwargs)
+            pool = self._pools[key] = _Pool(factory, self.min_size, self.max_size, self.idle_ttl,
+                                            self.health_check, partial(self._discard, key))
+
+        return pool
+
+    def _discard(self, key, pool: _Pool) -> None:
+        if self._pools.get(key) is pool:
+            del self._pools[key]
+
+    @property
+    def size(self) -> int:
+        """The total number of resources currently held, in use or idle."""
+        return sum(pool.size for pool in self._pools.values())
+
+    @property
+    def idle(self) -> int:
+        """The number of resources currently waiting to be checked out."""
+        return sum(pool.idle for pool in self._pools.values())
+
+    async def aclose(self) -> None:
+        """
+        Tear down all idle resources and stop pooling.
+
+        Resources still checked out are torn down as their ``async with`` blocks exit, and tasks
+        waiting for a resource get a :exc:`RuntimeError`. So does any later attempt to check out a
+        resource.
+
+        """
+        self._closed = True
+        pools = list(self._pools.values())
+        self._pools.clear()
+        for pool in pools:
+            await pool.aclose()
+
+
+def pooled_async_contextmanager(func: Callable[..., generator_types] = None, *,
+                                min_size: int = 0, max_size: int = 10, idle_ttl: float = None,
+                                health_check: Callable = None):
+    """
+    Like :func:`async_contextmanager`, but keep the yielded resources around for reuse.
+
+    The code before the ``yield`` runs only when the pool needs a new resource, and the code after
+    it runs only when the pool gets rid of one. That happens when:
+
+    * the resource has been idle for longer than ``idle_ttl`` (unless that would leave fewer than
+      ``min_size`` resources)
+    * ``health_check`` rejects it on checkout
+    * an exception is raised in the ``async with`` block (the exception is thrown into the
+      generator, just like with :func:`async_contextmanager`)
+    * the pool is closed with :meth:`AsyncResourcePool.aclose`
+
+    When ``max_size`` resources are checked out, further tasks wait for one to be returned and are
+    served in the order they arrived.
+
+    Usage::
+
+        @pooled_async_contextmanager(max_size=5, idle_ttl=60)
+        async def connection(host):
+            conn = await connect(host)
+            yield conn
+            await conn.close()
+
+        async def handler():
+            async with connection('db.example.org') as conn:
+                await conn.execute(...)
+
+    :param func: an async generator function or a coroutine function using
+        :func:`~async_generator.yield_`
+    :param min_size: number of resources per set of arguments that idle eviction leaves in place;
+        this is a retention floor, so resources are not created in advance to reach it
+    :param max_size: maximum number of resources per set of arguments
+    :param idle_ttl: seconds an unused resource is kept before being torn down
+    :param health_check: callable (or coroutine function) called with the resource on checkout,
+        returning a falsy value if it should be replaced
+    :return: an :class:`AsyncResourcePool`, or a decorator producing one if ``func`` was omitted
+
+    """
+    def wrapper(func: Callable[..., generator_types]) -> AsyncResourcePool:
+        if not isasyncgenfunction(func) and iscoroutinefunction(func):
+            func = async_generator(func)
+
+        return AsyncResourcePool(func, min_size, max_size, idle_ttl, health_check)
+
+    if func is not None:
+        return wrapper(func)
+    else:
+        return wrapper
+
+
+class _DependencyFailed(Exception):
+    pass
+
+
+class _StackEntry:
+    __slots__ = 'manager', 'context', 'value', 'dependencies', 'dependents', 'entered', 'exited'
+
+    def __init__(self, manager, dependencies: List['_StackEntry']) -> None:
+        self.manager = manager
+        self.context = None
+        self.value = None
+        self.dependencies = dependencies
+        self.dependents = []  # type: List[_StackEntry]
+        self.entered = get_event_loop().create_future()
+        self.exited = None
+
+
+class ConcurrentExitStack:
+    """
+    An asynchronous exit stack that enters and exits its context managers concurrently.
+
+    Context managers added to the stack are entered concurrently by :meth:`enter`, except that
+    a context manager added with ``depends_on`` is only entered after all of its dependencies have
+    been entered. When the stack exits, all context managers are exited concurrently, except that
+    a context manager is only exited after every context manager depending on it has been exited.
+
+    If any of the context managers fails to enter, the ones that did enter are exited with the
+    exception before it is raised from :meth:`enter`. Context managers depending on a failed one
+    are not entered at all.
+
+    An exception raised in the ``async with`` block is passed to every context manager on exit,
+    and is suppressed only if all of them suppress it.
+
+    Usage::
+
+        async with ConcurrentExitStack() as stack:
+            db, cache = await stack.enter_async_contexts(db_session(), cache_session())
+
+    Or, with dependencies::
+
+        async with ConcurrentExitStack() as stack:
+            conn = stack.add(connection())
+            stack.add(transaction, depends_on=[conn])
+            stack.add(cache_session())
+            conn_value, transaction_value, cache = await stack.enter()
+
+    Here ``transaction`` is called with the value of the entered connection to produce the context
+    manager to enter after it.
+
+    """
+
+    __slots__ = '_entries', '_pending', '_entered'
+
+    def __init__(self) -> None:
+        self._entries = {}  # type: dict
+        self._pending = []  # type: List[_StackEntry]
+        self._entered = []  # type: List[_StackEntry]
+
+    def add(self, manager, *, depends_on: Iterable = ()):
+        """
+        Add an asynchronous context manager to be entered on the next call to :meth:`enter`.
+
+        Instead of a context manager, a callable returning one can be given. It is called with the
+        values of the entered dependencies (in the order they were listed in ``depends_on``) when
+        they have all been entered.
+
+        :param manager: an asynchronous context manager, or a callable that returns one
+        :param depends_on: context managers (or callables) previously added to this stack that
+            must be entered before and exited after this one
+        :return: ``manager``
+
+        """
+        dependencies = []
+        for dependency in depends_on:
+            try:
+                dependencies.append(self._entries[id(dependency)])
+            except KeyError:
+                raise ValueError('%r has not been added to this stack' % dependency) from None
+
+        entry = _StackEntry(manager, dependencies)
+        for dependency in dependencies:
+            dependency.dependents.append(entry)
+
+        self._entries[id(manager)] = entry
+        self._pending.append(entry)
+        return manager
+
+    async def enter(self) -> list:
+        """
+        Enter all context managers added since the previous call.
+
+        :return: the values returned by the ``__aenter__()`` methods of the context managers, in
+            the order they were added
+
+        """
+        pending, self._pending = self._pending, []
+        results = await gather(*[self._enter(entry) for entry in pending],
+                               return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, _DependencyFailed):
+                entered = [entry for entry in pending if entry in self._entered]
+                for entry in pending:
+                    del self._entries[id(entry.manager)]
+
+                await self._exit(entered, type(result), result, result.__traceback__)
+                raise result
+
+        return results
+
+    async def enter_async_contexts(self, *managers) -> list:
+        """
+        Add the given context managers to the stack and enter them concurrently.
+
+        :param managers: asynchronous context managers
+        :return: the values returned by the ``__aenter__()`` methods of the context managers
+
+        """
+        for manager in managers:
+            self.add(manager)
+
+        results = await self.enter()
+        return results[len(results) - len(managers):]
+
+    async def aclose(self) -> None:
+        """Exit all context managers entered so far."""
+        await self.__aexit__(None, None, None)
+
+    async def _enter(self, entry: _StackEntry):
+        try:
+            for dependency in entry.dependencies:
+                if not await dependency.entered:
+                    raise _DependencyFailed
+
+            if hasattr(entry.manager, '__aenter__'):
+                context = entry.manager
+            else:
+                context = entry.manager(*[dependency.value for dependency in entry.dependencies])
+
+            value = await context.__aenter__()
+        except BaseException:
+            entry.entered.set_result(False)
+            raise
+
+        entry.context = context
+        entry.value = value
+        self._entered.append(entry)
+        entry.entered.set_result(True)
+        return value
+
+    async def _exit(self, entries: List[_StackEntry], exc_type, exc_val, exc_tb) -> bool:
+        async def exit_entry(entry: _StackEntry):
+            try:
+                dependents = [dependent.exited for dependent in entry.dependents
+                              if dependent.exited is not None]
+                if dependents:
+                    await wait(dependents)
+
+                return await entry.context.__aexit__(exc_type, exc_val, exc_tb)
+            finally:
+                entry.exited.set_result(None)
+
+        loop = get_event_loop()
+        for entry in entries:
+            entry.exited = loop.create_future()
+
+        results = await gather(*[exit_entry(entry) for entry in entries], return_exceptions=True)
+        for entry in entries:
+            self._entered.remove(entry)
+            self._entries.pop(id(entry.manager), None)
+
+        suppress = bool(results)
+        for result in results:
+            if isinstance(result, BaseException):
+                if result is not exc_val:
+                    raise result
+
+                suppress = False
+            elif not result:
+                suppress = False
+
+        return suppress
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for entry in self._pending:
+            del self._entries[id(entry.manager)]
+
+        self._pending.clear()
+        return await self._exit(list(self._entered), exc_type, exc_val, exc_tb)
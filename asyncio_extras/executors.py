@@ -0,0 +1,365 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import Executor, Future
+from itertools import count
+from threading import Condition, Lock, Thread, current_thread
+from time import monotonic
+from typing import Callable, Dict, Set  # noqa
+
+__all__ = ('AdaptiveThreadPoolExecutor', 'DeadlineExceeded', 'ExecutorOverloaded', 'QueueStats',
+           'register_executor', 'get_executor', 'get_queue_stats')
+
+#: maps names to registered executors
+_executors = {}  # type: Dict[str, Executor]
+_executors_lock = Lock()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call submitted with a deadline could not be started before it."""
+
+
+class ExecutorOverloaded(Exception):
+    """
+    Raised when a call is rejected because the executor already has the maximum number of calls
+    queued.
+    """
+
+
+class QueueStats(namedtuple('QueueStats', ['queued', 'max_queued', 'shed'])):
+    """
+    Queue statistics of an executor registered with a queue length limit.
+
+    .. attribute:: queued
+
+        the number of calls submitted through this library that have not started yet
+
+    .. attribute:: max_queued
+
+        the maximum number of queued calls
+
+    .. attribute:: shed
+
+        the total number of calls rejected because the queue was full
+    """
+
+    __slots__ = ()
+
+
+class _QueueLimit:
+    __slots__ = 'max_queued', 'queued', 'shed', 'lock'
+
+    def __init__(self, max_queued: int) -> None:
+        self.max_queued = max_queued
+        self.queued = 0
+        self.shed = 0
+        self.lock = Lock()
+
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.queued >= self.max_queued:
+                self.shed += 1
+                return False
+
+            self.queued += 1
+            return True
+
+    def release(self) -> None:
+        with self.lock:
+            self.queued -= 1
+
+
+#: maps executors registered with a queue length limit to their limits; checked on every executor
+#: submission, so this is kept empty when no limits are in use
+_queue_limits = {}  # type: Dict[Executor, _QueueLimit]
+
+
+class _WorkItem:
+    __slots__ = 'future', 'func', 'args', 'kwargs', 'enqueued'
+
+    def __init__(self, future: Future, func: Callable, args: tuple, kwargs: dict) -> None:
+        self.future = future
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = monotonic()
+
+    def run(self) -> None:
+        if not self.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except BaseException as exc:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(result)
+
+
+class AdaptiveThreadPoolExecutor(Executor):
+    """
+    A thread pool executor that adjusts its number of worker threads to the load.
+
+    Worker threads are added when submitted calls have been waiting in the queue for longer than
+    ``target_queue_wait`` seconds and no worker is idle, and they exit after having been idle for
+    ``idle_timeout`` seconds. The number of workers always stays between ``min_workers`` and
+    ``max_workers``.
+
+    Calls that are cancelled while still in the queue are dropped without being run.
+
+    To make the library's helpers use this executor when no executor is explicitly given, install
+    it with :func:`~asyncio_extras.threads.set_default_executor`::
+
+        set_default_executor(AdaptiveThreadPoolExecutor(max_workers=64))
+
+    :param min_workers: number of worker threads to keep even when idle
+    :param max_workers: maximum number of worker threads (defaults to the number of CPUs plus 4,
+        up to 32, like :class:`~concurrent.futures.ThreadPoolExecutor`)
+    :param idle_timeout: seconds a worker thread may stay idle before exiting (as long as there
+        are more than ``min_workers`` worker threads)
+    :param target_queue_wait: seconds a call may wait in the queue before another worker thread
+        is started for it
+    :param thread_name_prefix: prefix for the names of the worker threads
+
+    """
+
+    _counter = count()
+
+    def __init__(self, min_workers: int = 0, max_workers: int = None, idle_timeout: float = 10,
+                 target_queue_wait: float = 0.005, thread_name_prefix: str = '') -> None:
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        if min_workers < 0 or min_workers > max_workers:
+            raise ValueError('min_workers must be between 0 and max_workers')
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.target_queue_wait = target_queue_wait
+        self._thread_name_prefix = (
+            thread_name_prefix or 'AdaptiveThreadPoolExecutor-%d' % next(self._counter))
+        self._queue = deque()  # type: deque
+        self._lock = Lock()
+        self._work_available = Condition(self._lock)
+        self._monitor_wakeup = Condition(self._lock)
+        self._threads = set()  # type: Set[Thread]
+        self._thread_counter = count()
+        self._idle = 0
+        self._monitor = None  # type: Thread
+        self._shutdown = False
+
+    @property
+    def worker_count(self) -> int:
+        """The current number of worker threads."""
+        return len(self._threads)
+
+    @property
+    def queue_size(self) -> int:
+        """The number of submitted calls waiting for a worker thread."""
+        return len(self._queue)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        item = _WorkItem(future, fn, args, kwargs)
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            self._queue.append(item)
+            if len(self._queue) <= self._idle:
+                self._work_available.notify()
+            elif not self._threads or len(self._threads) < self.min_workers:
+                self._start_worker()
+            elif len(self._threads) < self.max_workers:
+                # Let the monitor thread decide if the call has waited long enough to warrant a
+                # new worker
+                if self._monitor is None:
+                    self._monitor = self._start_thread(self._run_monitor, 'monitor')
+                else:
+                    self._monitor_wakeup.notify()
+
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft().future.cancel()
+
+            self._work_available.notify_all()
+            self._monitor_wakeup.notify_all()
+            threads = list(self._threads)
+            if self._monitor is not None:
+                threads.append(self._monitor)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start_thread(self, target: Callable, suffix) -> Thread:
+        thread = Thread(target=target, name='%s_%s' % (self._thread_name_prefix, suffix))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _start_worker(self) -> None:
+        # Must be called with the lock held
+        thread = self._start_thread(self._run_worker, next(self._thread_counter))
+        self._threads.add(thread)
+
+    def _start_needed_workers(self) -> int:
+        # Start a worker for each call that has waited too long and that no idle worker is about to
+        # pick up. Must be called with the lock held.
+        deadline = monotonic() - self.target_queue_wait
+        overdue = 0
+        for item in self._queue:
+            if item.enqueued > deadline:
+                break
+
+            overdue += 1
+
+        needed = min(overdue - self._idle, self.max_workers - len(self._threads))
+        for _ in range(needed):
+            self._start_worker()
+
+        return max(needed, 0)
+
+    def _run_worker(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queue:
+                    if self._shutdown:
+                        self._threads.discard(current_thread())
+                        return
+
+                    self._idle += 1
+                    notified = self._work_available.wait(self.idle_timeout)
+                    self._idle -= 1
+                    if notified or self._queue:
+                        continue
+
+                    if len(self._threads) > self.min_workers:
+                        self._threads.discard(current_thread())
+                        return
+
+                item = self._queue.popleft()
+                self._start_needed_workers()
+
+            item.run()
+            del item
+
+    def _run_monitor(self) -> None:
+        with self._lock:
+            while not self._shutdown:
+                if not self._queue:
+                    self._monitor_wakeup.wait()
+                elif self._start_needed_workers():
+                    # Give the new workers a chance to catch up before adding more
+                    self._monitor_wakeup.wait(self.target_queue_wait)
+                else:
+                    remaining = self.target_queue_wait - (monotonic() - self._queue[0].enqueued)
+                    self._monitor_wakeup.wait(remaining if remaining > 0
+                                              else self.target_queue_wait)
+
+
+def _create_io_executor() -> Executor:
+    return AdaptiveThreadPoolExecutor(max_workers=32, thread_name_prefix='asyncio_extras-io')
+
+
+#: factories for the executors that are created on first use unless registered explicitly
+_builtin_executors = {'io': _create_io_executor}  # type: Dict[str, Callable[[], Executor]]
+
+
+def register_executor(name: str, executor: Executor, *, max_queued: int = None) -> None:
+    """
+    Register an executor under the given name.
+
+    Registered executors can be used by passing their names wherever this library accepts an
+    executor. This makes it easy to keep different kinds of work in separate pools, so that for
+    example a burst of slow calls to a database does not hold up file operations::
+
+        register_executor('cpu', ProcessPoolExecutor())
+        register_executor('db', ThreadPoolExecutor(4))
+
+        @threadpool('db')
+        def fetch_rows(connection):
+            ...
+
+        result = await call_in_executor(compress, data, executor='cpu')
+
+    The asynchronous file operations use the executor named ``io`` by default. Unless an executor
+    has been registered by that name before its first use, an
+    :class:`AdaptiveThreadPoolExecutor` with up to 32 worker threads is created for it.
+
+    If ``max_queued`` is given, at most that many calls submitted to the executor through this
+    library may be waiting for a worker thread at any time. Further calls are rejected right away
+    with :exc:`ExecutorOverloaded` instead of adding to the queue, which helps to keep latencies in
+    check when there is more work than the executor can handle. Use :func:`get_queue_stats` to see
+    how many calls have been rejected.
+
+    Registering an executor under an existing name replaces the previous one. The replaced
+    executor is not shut down.
+
+    :param name: the name of the executor
+    :param executor: the executor to register
+    :param max_queued: the maximum number of calls queued for the executor
+
+    """
+    if max_queued is not None and max_queued < 0:
+        raise ValueError('max_queued must not be negative')
+
+    with _executors_lock:
+        previous = _executors.get(name)
+        if previous is not None and previous is not executor:
+            _queue_limits.pop(previous, None)
+
+        _executors[name] = executor
+        if max_queued is not None:
+            _queue_limits[executor] = _QueueLimit(max_queued)
+        else:
+            _queue_limits.pop(executor, None)
+
+
+def get_executor(name: str) -> Executor:
+    """
+    Return the executor registered under the given name.
+
+    :param name: the name of the executor
+    :return: the executor
+    :raises LookupError: if no executor has been registered by that name
+
+    """
+    try:
+        return _executors[name]
+    except KeyError:
+        with _executors_lock:
+            if name not in _executors:
+                try:
+                    factory = _builtin_executors[name]
+                except KeyError:
+                    raise LookupError('no executor has been registered by the name {!r}'
+                                      .format(name)) from None
+
+                _executors[name] = factory()
+
+            return _executors[name]
+
+
+def get_queue_stats(name: str) -> QueueStats:
+    """
+    Return the queue statistics of an executor registered with a queue length limit.
+
+    :param name: the name of the executor
+    :return: the current statistics
+    :raises LookupError: if no executor has been registered by that name with ``max_queued``
+
+    """
+    limit = _queue_limits.get(_executors.get(name))
+    if limit is None:
+        raise LookupError('no executor has been registered by the name {!r} with a queue length '
+                          'limit'.format(name))
+
+    with limit.lock:
+        return QueueStats(limit.queued, limit.max_queued, limit.shed)
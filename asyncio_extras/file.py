@@ -1,14 +1,143 @@
+import errno
+import mmap
+import os
+import selectors
+import shutil
+import socket  # noqa
 import sys
+from asyncio import get_event_loop, wait, gather, CancelledError
+from collections import deque
 from concurrent.futures import Executor
+from contextlib import contextmanager
+from functools import partial
 from io import IOBase  # noqa
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, Callable, List, AnyStr, Iterable, Tuple  # noqa
+from uuid import uuid4
 
 from async_generator import async_generator, yield_
 
-from asyncio_extras.threads import threadpool, call_in_executor
+from asyncio_extras.threads import _submit, _call_in_thread
 
-__all__ = ('AsyncFileWrapper', 'open_async')
+__all__ = ('BufferPool', 'AsyncFileWrapper', 'AsyncBufferedWriter', 'AsyncMappedFile',
+           'open_async', 'mmap_async',
+           'read_file_async', 'write_file_async', 'copy_async', 'sendfile_async')
+
+#: errors from the kernel copying functions that mean they cannot be used with the given files
+_fallback_errnos = {errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def _threadpool_method(name: str) -> Callable:
+    def method(self, *args, **kwargs):
+        func = getattr(self._raw_file, name)
+        return _call_in_thread(self._executor, self._affinity, func, args, kwargs)
+
+    method.__name__ = name
+    method.__qualname__ = 'AsyncFileWrapper.' + name
+    method.__doc__ = 'Call ``{}()`` on the underlying file in a worker thread.'.format(name)
+    return method
+
+
+class BufferPool:
+    """
+    A bounded pool of reusable, fixed size byte buffers.
+
+    Buffers are created as needed until ``max_buffers`` have been created. After that,
+    :meth:`acquire` waits until a buffer is released back to the pool.
+
+    This class is not thread safe and must only be used from the event loop thread.
+
+    :param buffer_size: size of each buffer (in bytes)
+    :param max_buffers: maximum number of buffers in the pool
+    """
+
+    __slots__ = 'buffer_size', 'max_buffers', '_created', '_free', '_waiters'
+
+    def __init__(self, buffer_size: int, max_buffers: int) -> None:
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._created = 0
+        self._free = []  # type: List[bytearray]
+        self._waiters = deque()
+
+    async def acquire(self) -> bytearray:
+        """
+        Take a buffer from the pool, waiting for one to be released if necessary.
+
+        :return: a buffer of ``buffer_size`` bytes
+
+        """
+        if self._free:
+            return self._free.pop()
+        elif self._created < self.max_buffers:
+            self._created += 1
+            return bytearray(self.buffer_size)
+
+        waiter = get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except CancelledError:
+            # Don't lose the buffer if it was handed to us just as we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+
+            raise
+
+    def release(self, buffer: Union[bytearray, memoryview]) -> None:
+        """
+        Give a buffer back to the pool.
+
+        If a :class:`memoryview` is given, it is released and the buffer it refers to is returned
+        to the pool.
+
+        :param buffer: a buffer previously acquired from this pool, or a view of one
+
+        """
+        if isinstance(buffer, memoryview):
+            view, buffer = buffer, buffer.obj
+            view.release()
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(buffer)
+                return
+
+        self._free.append(buffer)
+
+    @contextmanager
+    def releasing(self, buffer: Union[bytearray, memoryview]):
+        """
+        Return a context manager that releases the given buffer back to the pool on exit.
+
+        :param buffer: a buffer previously acquired from this pool, or a view of one
+        :return: a context manager yielding ``buffer``
+
+        """
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+def _pread(fd: int, offset: int, size: int) -> bytes:
+    data = os.pread(fd, size, offset)
+    if len(data) in (0, size):
+        return data
+
+    # Short read; keep reading until the requested size or the end of the file is reached
+    chunks = [data]
+    while size > len(data):
+        offset += len(data)
+        size -= len(data)
+        data = os.pread(fd, size, offset)
+        if not data:
+            break
+
+        chunks.append(data)
+
+    return b''.join(chunks)
 
 
 class AsyncFileWrapper:
@@ -18,27 +147,43 @@ class AsyncFileWrapper:
     The wrapped methods work like coroutines when called in the event loop thread, but when called
     in any other thread, they work just like the methods of the ``file`` type.
 
-    This class supports use as an asynchronous context manager.
+    This class supports use as an asynchronous context manager. The file is closed in a worker
+    thread on exit.
 
     The wrapped methods are:
 
     * ``flush()``
+    * ``peek()``
     * ``read()``
+    * ``read1()``
+    * ``readinto()``
+    * ``readinto1()``
     * ``readline()``
     * ``readlines()``
     * ``seek()``
+    * ``tell()``
     * ``truncate()``
     * ``write()``
     * ``writelines()``
+
+    Any other attributes are looked up from the underlying file object and are not run in a worker
+    thread. This includes ``close()``, which is kept synchronous for the sake of code like
+    :func:`contextlib.closing` but may block while flushing buffered data to disk; use
+    :meth:`aclose` instead in the event loop thread.
+
+    If ``affinity`` is ``True``, the wrapped operations on this file are run one at a time in the
+    order they were called, on a single worker thread (see the ``affinity`` argument of
+    :func:`~asyncio_extras.threads.threadpool`).
     """
 
-    __slots__ = ('_open_args', '_open_kwargs', '_executor', '_raw_file', 'flush', 'read',
-                 'readline', 'readlines', 'seek', 'truncate', 'write', 'writelines')
+    __slots__ = '_open_args', '_open_kwargs', '_executor', '_affinity', '_raw_file'
 
-    def __init__(self, path: str, args: tuple, kwargs: dict, executor: Optional[Executor]) -> None:
+    def __init__(self, path: str, args: tuple, kwargs: dict, executor: Union[Executor, str, None],
+                 affinity: bool = False) -> None:
         self._open_args = (path,) + args
         self._open_kwargs = kwargs
         self._executor = executor
+        self._affinity = self if affinity else None
         self._raw_file = None  # type: IOBase
 
     def __getattr__(self, name):
@@ -46,24 +191,36 @@ class AsyncFileWrapper:
 
     def __await__(self):
         if self._raw_file is None:
-            self._raw_file = yield from call_in_executor(
-                open, *self._open_args, executor=self._executor, **self._open_kwargs)
-            self.flush = threadpool(self._executor)(self._raw_file.flush)
-            self.read = threadpool(self._executor)(self._raw_file.read)
-            self.readline = threadpool(self._executor)(self._raw_file.readline)
-            self.readlines = threadpool(self._executor)(self._raw_file.readlines)
-            self.seek = threadpool(self._executor)(self._raw_file.seek)
-            self.truncate = threadpool(self._executor)(self._raw_file.truncate)
-            self.write = threadpool(self._executor)(self._raw_file.write)
-            self.writelines = threadpool(self._executor)(self._raw_file.writelines)
+            opener = partial(open, *self._open_args, **self._open_kwargs)
+            self._raw_file = yield from _submit(get_event_loop(), self._executor, opener,
+                                                self._affinity)
 
         return self
 
+    flush = _threadpool_method('flush')
+    peek = _threadpool_method('peek')
+    read = _threadpool_method('read')
+    read1 = _threadpool_method('read1')
+    readinto = _threadpool_method('readinto')
+    readinto1 = _threadpool_method('readinto1')
+    readline = _threadpool_method('readline')
+    readlines = _threadpool_method('readlines')
+    seek = _threadpool_method('seek')
+    tell = _threadpool_method('tell')
+    truncate = _threadpool_method('truncate')
+    write = _threadpool_method('write')
+    writelines = _threadpool_method('writelines')
+
     def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        self._raw_file.close()
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Flush any buffered data and close the file in a worker thread."""
+        if self._raw_file is not None:
+            await _submit(get_event_loop(), self._executor, self._raw_file.close, self._affinity)
 
     if sys.version_info < (3, 5, 2):
         async def __aiter__(self):  # pragma: no cover
@@ -83,24 +240,263 @@ class AsyncFileWrapper:
             raise StopAsyncIteration
 
     @async_generator
-    async def async_readchunks(self, size: int):
+    async def async_iterlines(self, buffer_size: int = 65536):
+        """
+        Iterate over the lines in the file, reading many lines at once.
+
+        Unlike asynchronous iteration of the file wrapper itself, which reads one line per trip to
+        the worker thread, this reads complete lines amounting to roughly ``buffer_size`` bytes or
+        characters per trip and then serves them from memory. Decoding and newline translation
+        are handled by the underlying file object just like with regular line iteration.
+
+        :param buffer_size: the approximate number of bytes or characters to read at once
+        :return: an asynchronous iterator yielding lines as bytes or strings
+
+        """
+        if self._raw_file is None:
+            await self
+
+        while True:
+            lines = await self.readlines(buffer_size)
+            if not lines:
+                return
+
+            for line in lines:
+                await yield_(line)
+
+    @async_generator
+    async def async_readchunks(self, size: int, prefetch: int = 0):
         """
         Read data from the file in chunks.
 
+        If ``prefetch`` is a positive number, that many reads are kept in progress in the
+        background while the consumer is processing the current chunk, so that the file is being
+        read at the same time as its contents are being processed. The reads are still done in
+        order. This uses up to ``(prefetch + 1) * size`` bytes or characters of memory.
+
         :param size: the maximum number of bytes or characters to read at once
+        :param prefetch: the number of chunks to read ahead
         :return: an asynchronous iterator yielding bytes or strings
 
         """
-        while True:
-            data = await self.read(size)
-            if data:
+        if prefetch <= 0:
+            while True:
+                data = await self.read(size)
+                if data:
+                    await yield_(data)
+                else:
+                    return
+
+        # Use the wrapper as the affinity key to keep the reads in order
+        loop = get_event_loop()
+        read = partial(self._raw_file.read, size)
+        pending = deque(_submit(loop, self._executor, read, self) for _ in range(prefetch))
+        try:
+            while True:
+                data = await pending.popleft()
+                if not data:
+                    return
+
+                pending.append(_submit(loop, self._executor, read, self))
                 await yield_(data)
-            else:
+        finally:
+            # Don't let the file be closed while reads are still in progress
+            if pending:
+                await wait(pending)
+                for future in pending:
+                    # The consumer is gone, so errors from reading ahead are of no interest
+                    if not future.cancelled():
+                        future.exception()
+
+    @async_generator
+    async def async_readinto_chunks(self, pool: BufferPool):
+        """
+        Read data from the file in chunks, into buffers taken from the given pool.
+
+        This avoids allocating new memory for every chunk. Each chunk is yielded as a
+        :class:`memoryview` of a pooled buffer, and must be given back to the pool with
+        :meth:`BufferPool.release` or :meth:`BufferPool.releasing` once the caller is done with
+        it. If no buffers are available, the iteration waits until one is released.
+
+        Example::
+
+            pool = BufferPool(65536, 4)
+            async with open_async(path, 'rb') as f:
+                async for chunk in f.async_readinto_chunks(pool):
+                    with pool.releasing(chunk):
+                        await sock.sendall(chunk)
+
+        The file must have been opened in binary mode.
+
+        :param pool: the pool to take buffers from
+        :return: an asynchronous iterator yielding memoryviews
+
+        """
+        if not hasattr(self._raw_file, 'readinto'):
+            raise TypeError('async_readinto_chunks() requires a file opened in binary mode')
+
+        while True:
+            buffer = await pool.acquire()
+            try:
+                length = await self.readinto(buffer)
+            except BaseException:
+                pool.release(buffer)
+                raise
+
+            if not length:
+                pool.release(buffer)
                 return
 
+            await yield_(memoryview(buffer)[:length])
+
+    async def pread(self, offset: int, size: int) -> bytes:
+        """
+        Read data from the given position in the file, without changing the file position.
+
+        Unlike the other methods, this can safely be called several times at once, and the calls
+        will run in parallel in separate worker threads (even if ``affinity`` is enabled).
+
+        This reads directly from the operating system (using :func:`os.pread`), bypassing the
+        file object's own buffer, so any buffered writes should be flushed first.
+
+        Availability: Unix.
+
+        :param offset: the position in the file to read from
+        :param size: the number of bytes to read
+        :return: the data read (shorter than ``size`` if the end of the file was reached)
+
+        """
+        return await _submit(get_event_loop(), self._executor,
+                             partial(_pread, self._raw_file.fileno(), offset, size))
+
+    async def read_ranges(self, ranges: Iterable[Tuple[int, int]]) -> List[bytes]:
+        """
+        Read several ranges of the file in parallel with :meth:`pread`.
+
+        Availability: Unix.
+
+        :param ranges: an iterable of ``(offset, size)`` tuples
+        :return: a list of data read from each range, in the same order as ``ranges``
+
+        """
+        return await gather(*[self.pread(offset, size) for offset, size in ranges])
+
+    def buffered_writer(self, buffer_size: int = 65536,
+                        flush_interval: float = None) -> 'AsyncBufferedWriter':
+        """
+        Return a writer that collects small writes and writes them to this file in batches.
+
+        :param buffer_size: the ``buffer_size`` argument to :class:`AsyncBufferedWriter`
+        :param flush_interval: the ``flush_interval`` argument to :class:`AsyncBufferedWriter`
+        :return: a buffered writer
+
+        """
+        return AsyncBufferedWriter(self, buffer_size, flush_interval)
+
 
-def open_async(file: Union[str, Path], *args, executor: Executor = None,
-               **kwargs) -> AsyncFileWrapper:
+def _write_batch(file: IOBase, chunks: list) -> None:
+    file.writelines(chunks)
+    file.flush()
+
+
+class AsyncBufferedWriter:
+    """
+    Collects writes in the event loop thread and writes them to an opened file in batches.
+
+    Writing data does not involve a worker thread until at least ``buffer_size`` bytes or
+    characters have been collected, or ``flush_interval`` seconds have passed since the first
+    write to an empty buffer. At that point the collected data is written and flushed to the file
+    in a single call in a worker thread, which runs in the background while new data is collected.
+    If the buffer fills up again before the previous batch has been written, :meth:`write` waits
+    for it to finish.
+
+    Errors from writing a batch in the background are raised from the next call to :meth:`write`
+    or :meth:`flush`.
+
+    This class supports use as an asynchronous context manager, which flushes the writer on exit.
+    It does not close the file.
+
+    :param file: an opened file wrapper
+    :param buffer_size: the number of bytes or characters to collect before writing them
+    :param flush_interval: the maximum number of seconds to keep data in the buffer
+    """
+
+    __slots__ = '_file', 'buffer_size', 'flush_interval', '_buffer', '_buffered', '_pending', \
+        '_timer'
+
+    def __init__(self, file: AsyncFileWrapper, buffer_size: int = 65536,
+                 flush_interval: float = None) -> None:
+        self._file = file
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []  # type: List[AnyStr]
+        self._buffered = 0
+        self._pending = None
+        self._timer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.flush()
+
+    def _start_batch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        chunks, self._buffer, self._buffered = self._buffer, [], 0
+        file = self._file
+        self._pending = _submit(get_event_loop(), file._executor,
+                                partial(_write_batch, file._raw_file, chunks), file._affinity)
+
+    async def _wait_pending(self) -> None:
+        while self._pending is not None:
+            pending = self._pending
+            try:
+                await pending
+            finally:
+                if self._pending is pending:
+                    self._pending = None
+
+    def _flush_on_timer(self) -> None:
+        self._timer = None
+        if self._pending is None:
+            if self._buffer:
+                self._start_batch()
+        else:
+            # A batch is already being written; try again later
+            self._timer = get_event_loop().call_later(self.flush_interval, self._flush_on_timer)
+
+    async def write(self, data: AnyStr) -> int:
+        """
+        Add data to the buffer.
+
+        :param data: the bytes or string to write
+        :return: the number of bytes or characters added
+
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            await self._wait_pending()
+            if self._buffer:
+                self._start_batch()
+        elif self.flush_interval is not None and self._timer is None:
+            self._timer = get_event_loop().call_later(self.flush_interval, self._flush_on_timer)
+
+        return len(data)
+
+    async def flush(self) -> None:
+        """Write any buffered data to the file and wait until it has been written."""
+        await self._wait_pending()
+        if self._buffer:
+            self._start_batch()
+            await self._wait_pending()
+
+
+def open_async(file: Union[str, Path], *args, executor: Union[Executor, str] = 'io',
+               affinity: bool = False, **kwargs) -> AsyncFileWrapper:
     """
     Open a file and wrap it in an :class:`~AsyncFileWrapper`.
 
@@ -116,11 +512,410 @@ def open_async(file: Union[str, Path], *args, executor: Executor = None,
             async for line in open_async(path):
                 print(line)
 
+    For large files, :meth:`~AsyncFileWrapper.async_iterlines` is much faster as it reads many
+    lines per trip to the worker thread::
+
+        async def read_file_lines(path: str):
+            async with open_async(path) as f:
+                async for line in f.async_iterlines():
+                    print(line)
+
+    By default, the file operations are run in the executor named ``io``, so that slow disk access
+    does not hold up other work submitted to executors and vice versa (see
+    :func:`~asyncio_extras.executors.register_executor`).
+
     :param file: the file path to open
     :param args: positional arguments to :func:`open`
-    :param executor: the ``executor`` argument to :class:`~AsyncFileWrapper`
+    :param executor: the executor (or the name of a registered executor) in which to run the file
+        operations
+    :param affinity: the ``affinity`` argument to :class:`~AsyncFileWrapper`
     :param kwargs: keyword arguments to :func:`open`
     :return: the wrapped file object
 
     """
-    return AsyncFileWrapper(str(file), args, kwargs, executor)
+    return AsyncFileWrapper(str(file), args, kwargs, executor, affinity)
+
+
+class _EmptyMap(bytearray):
+    """Stands in for the memory map of an empty file, as those cannot be mapped."""
+
+    __slots__ = 'closed'
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _map_file(path: str) -> Union[mmap.mmap, _EmptyMap]:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _EmptyMap()
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _prefetch_pages(mapped: mmap.mmap, start: int, end: int) -> None:
+    start -= start % mmap.PAGESIZE
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_WILLNEED, start, end - start)
+    else:
+        # Fault the pages in by touching one byte on each of them
+        for offset in range(start, end, mmap.PAGESIZE):
+            mapped[offset]
+
+
+class AsyncMappedFile:
+    """
+    Maps a file into memory for random access reads.
+
+    The file is opened and mapped in a worker thread. After that, slices of the file can be
+    obtained as :class:`memoryview` objects with :meth:`view` without a trip to a worker thread and
+    without copying any data. Accessing parts of the file that are not yet in memory will block
+    while the operating system reads them from disk, so any ranges that may not be resident
+    should be loaded with :meth:`prefetch` (or read with :meth:`read`) first.
+
+    This class supports use as an asynchronous context manager. All views must be released before
+    the file is closed.
+    """
+
+    __slots__ = '_path', '_executor', '_mmap'
+
+    def __init__(self, path: str, executor: Union[Executor, str, None]) -> None:
+        self._path = path
+        self._executor = executor
+        self._mmap = None  # type: Union[mmap.mmap, _EmptyMap]
+
+    def __await__(self):
+        if self._mmap is None:
+            self._mmap = yield from _submit(get_event_loop(), self._executor,
+                                            partial(_map_file, self._path))
+
+        return self
+
+    def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._mmap)
+
+    @property
+    def closed(self) -> bool:
+        return self._mmap is None or self._mmap.closed
+
+    def close(self) -> None:
+        """Unmap the file."""
+        self._mmap.close()
+
+    def view(self, offset: int = 0, size: int = None) -> memoryview:
+        """
+        Return a view of a range of the file's contents.
+
+        :param offset: offset of the first byte
+        :param size: number of bytes (default: up to the end of the file)
+        :return: a read-only view of the mapped file
+
+        """
+        end = len(self._mmap) if size is None else offset + size
+        return memoryview(self._mmap)[offset:end]
+
+    async def prefetch(self, offset: int = 0, size: int = None) -> None:
+        """
+        Load a range of the file into memory in a worker thread.
+
+        Uses ``madvise(MADV_WILLNEED)`` where available and falls back to touching every memory
+        page in the range.
+
+        :param offset: offset of the first byte
+        :param size: number of bytes (default: up to the end of the file)
+
+        """
+        end = len(self._mmap) if size is None else min(offset + size, len(self._mmap))
+        if offset < end:
+            await _submit(get_event_loop(), self._executor,
+                          partial(_prefetch_pages, self._mmap, offset, end))
+
+    async def read(self, offset: int = 0, size: int = None) -> memoryview:
+        """
+        Load a range of the file into memory and return a view of it.
+
+        This is a shortcut for calling :meth:`prefetch` followed by :meth:`view`.
+
+        :param offset: offset of the first byte
+        :param size: number of bytes (default: up to the end of the file)
+        :return: a read-only view of the mapped file
+
+        """
+        await self.prefetch(offset, size)
+        return self.view(offset, size)
+
+
+def mmap_async(file: Union[str, Path], *,
+               executor: Union[Executor, str] = 'io') -> AsyncMappedFile:
+    """
+    Memory-map a file for reading and wrap it in an :class:`~AsyncMappedFile`.
+
+    Example::
+
+        async def read_record(path: str, offset: int, size: int) -> bytes:
+            async with mmap_async(path) as f:
+                with await f.read(offset, size) as view:
+                    return view.tobytes()
+
+    :param file: the file path to open
+    :param executor: the executor (or the name of a registered executor) in which to open and map
+        the file and to prefetch data
+    :return: the wrapped memory map
+
+    """
+    return AsyncMappedFile(str(file), executor)
+
+
+def _read_file(path: str, mode: str, kwargs: dict):
+    with open(path, mode, **kwargs) as f:
+        return f.read()
+
+
+def _write_file(path: str, data, mode: str, atomic: bool, kwargs: dict) -> int:
+    if not atomic:
+        with open(path, mode, **kwargs) as f:
+            return f.write(data)
+
+    directory, filename = os.path.split(path)
+    temp_path = os.path.join(directory, '.{}.{}.tmp'.format(filename, uuid4().hex))
+    try:
+        with open(temp_path, mode.replace('w', 'x'), **kwargs) as f:
+            written = f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            shutil.copymode(path, temp_path)
+        except FileNotFoundError:
+            pass
+
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+        raise
+
+    return written
+
+
+async def read_file_async(file: Union[str, Path], mode: str = 'rb', *,
+                          executor: Union[Executor, str] = 'io', **kwargs):
+    """
+    Read the entire contents of a file.
+
+    The file is opened, read and closed in a single call in a worker thread.
+
+    :param file: the file path to read
+    :param mode: the file open mode (``rb`` or ``r``)
+    :param executor: the executor (or the name of a registered executor) in which to read the file
+    :param kwargs: keyword arguments to :func:`open`
+    :return: the contents of the file as bytes or a string
+
+    """
+    return await _submit(get_event_loop(), executor, partial(_read_file, str(file), mode, kwargs))
+
+
+async def write_file_async(file: Union[str, Path], data: AnyStr, mode: str = 'wb', *,
+                           atomic: bool = False, executor: Union[Executor, str] = 'io',
+                           **kwargs) -> int:
+    """
+    Write the given data to a file.
+
+    The file is opened, written and closed in a single call in a worker thread.
+
+    If ``atomic`` is ``True``, the data is first written to a temporary file in the same directory,
+    which is then flushed to disk and renamed over the target file. Other processes will then see
+    either the old or the new contents of the file, but never anything in between. The permissions
+    of an existing target file are preserved.
+
+    :param file: the file path to write
+    :param data: the bytes or string to write
+    :param mode: the file open mode (``wb``, ``w``, ``ab`` or ``a``)
+    :param atomic: ``True`` to replace the file atomically
+    :param executor: the executor (or the name of a registered executor) in which to write the file
+    :param kwargs: keyword arguments to :func:`open`
+    :return: the number of bytes or characters written
+
+    """
+    if atomic and 'w' not in mode:
+        raise ValueError('atomic writes require a "w" mode')
+
+    return await _submit(get_event_loop(), executor,
+                         partial(_write_file, str(file), data, mode, atomic, kwargs))
+
+
+def _progress_reporter(progress: Optional[Callable[[int, int], None]]) -> Callable:
+    if progress is None:
+        return lambda copied, total: None
+
+    loop = get_event_loop()
+    return partial(loop.call_soon_threadsafe, progress)
+
+
+def _open_copy_destination(fsrc: IOBase, dst: str) -> IOBase:
+    # Opening the source file itself for writing would truncate it
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        pass
+    else:
+        if os.path.samestat(os.fstat(fsrc.fileno()), dst_stat):
+            raise shutil.SameFileError('{!r} and {!r} are the same file'.format(fsrc.name, dst))
+
+    return open(dst, 'wb')
+
+
+def _copy_file(src: str, dst: str, chunk_size: int, report: Callable[[int, int], None]) -> int:
+    with open(src, 'rb') as fsrc, _open_copy_destination(fsrc, dst) as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        total = os.fstat(infd).st_size
+        copied = 0
+        kernel_copiers = []
+        if hasattr(os, 'copy_file_range'):
+            kernel_copiers.append(lambda: os.copy_file_range(infd, outfd, chunk_size))
+        if sys.platform.startswith('linux'):
+            kernel_copiers.append(lambda: os.sendfile(outfd, infd, copied, chunk_size))
+
+        for copy in kernel_copiers:
+            try:
+                while True:
+                    length = copy()
+                    if not length:
+                        return copied
+
+                    copied += length
+                    report(copied, total)
+            except OSError as exc:
+                if copied or exc.errno not in _fallback_errnos:
+                    raise
+
+        buffer = memoryview(bytearray(chunk_size))
+        while True:
+            length = fsrc.readinto(buffer)
+            if not length:
+                return copied
+
+            fdst.write(buffer[:length])
+            copied += length
+            report(copied, total)
+
+
+def _send_file(path: str, sock: 'socket.socket', offset: int, count: Optional[int],
+               chunk_size: int, report: Callable[[int, int], None]) -> int:
+    # select.select() cannot handle file descriptors above FD_SETSIZE, so use a selector
+    with open(path, 'rb') as f, selectors.DefaultSelector() as selector:
+        wait_writable = selector.select
+        infd, sockfd = f.fileno(), sock.fileno()
+        selector.register(sockfd, selectors.EVENT_WRITE)
+        end = os.fstat(infd).st_size if count is None else offset + count
+        total = end - offset
+        sent = 0
+        if hasattr(os, 'sendfile'):
+            try:
+                while sent < total:
+                    try:
+                        length = os.sendfile(sockfd, infd, offset + sent,
+                                             min(chunk_size, total - sent))
+                    except BlockingIOError:
+                        wait_writable()
+                        continue
+
+                    if not length:
+                        return sent
+
+                    sent += length
+                    report(sent, total)
+
+                return sent
+            except OSError as exc:
+                if sent or exc.errno not in _fallback_errnos:
+                    raise
+
+        f.seek(offset)
+        while sent < total:
+            data = memoryview(f.read(min(chunk_size, total - sent)))
+            if not data:
+                return sent
+
+            while data:
+                try:
+                    length = sock.send(data)
+                except BlockingIOError:
+                    wait_writable()
+                else:
+                    data = data[length:]
+                    sent += length
+                    report(sent, total)
+
+        return sent
+
+
+async def copy_async(src: Union[str, Path], dst: Union[str, Path], *,
+                     chunk_size: int = 8388608,
+                     progress: Callable[[int, int], None] = None,
+                     executor: Union[Executor, str] = 'io') -> int:
+    """
+    Copy the contents of a file to another file.
+
+    The entire copy runs in a single call in a worker thread. Where available,
+    :func:`os.copy_file_range` or :func:`os.sendfile` is used so that the data is copied by the
+    operating system kernel without passing through Python. Otherwise the file is copied in
+    chunks.
+
+    If given, the ``progress`` callback is called in the event loop thread after each chunk with
+    two arguments: the number of bytes copied so far and the size of the source file.
+
+    :param src: path to the file to copy
+    :param dst: path to the destination file (overwritten if it exists)
+    :param chunk_size: the maximum number of bytes to copy at once
+    :param progress: a callable for reporting progress
+    :param executor: the executor (or the name of a registered executor) in which to copy the file
+    :return: the number of bytes copied
+    :raises shutil.SameFileError: if ``src`` and ``dst`` refer to the same file
+
+    """
+    copier = partial(_copy_file, str(src), str(dst), chunk_size, _progress_reporter(progress))
+    return await _submit(get_event_loop(), executor, copier)
+
+
+async def sendfile_async(file: Union[str, Path], sock: 'socket.socket', offset: int = 0,
+                         count: int = None, *, chunk_size: int = 8388608,
+                         progress: Callable[[int, int], None] = None,
+                         executor: Union[Executor, str] = 'io') -> int:
+    """
+    Send the contents of a file through a connected socket.
+
+    The entire transfer runs in a single call in a worker thread, using :func:`os.sendfile` where
+    available and falling back to reading the file in chunks and sending them otherwise. Both
+    blocking and non-blocking sockets are supported, but the socket must not be used by anything
+    else (like an asyncio transport) during the transfer.
+
+    If given, the ``progress`` callback is called in the event loop thread with two arguments:
+    the number of bytes sent so far and the total number of bytes to send.
+
+    :param file: path to the file to send
+    :param sock: a connected stream socket
+    :param offset: the offset in the file to start sending from
+    :param count: the number of bytes to send (default: up to the end of the file)
+    :param chunk_size: the maximum number of bytes to send at once
+    :param progress: a callable for reporting progress
+    :param executor: the executor (or the name of a registered executor) in which to send the file
+    :return: the number of bytes sent
+
+    """
+    sender = partial(_send_file, str(file), sock, offset, count, chunk_size,
+                     _progress_reporter(progress))
+    return await _submit(get_event_loop(), executor, sender)
@@ -0,0 +1,210 @@
+import logging
+import time
+from collections import namedtuple, deque
+from functools import partial
+from threading import Lock
+from types import FrameType
+from typing import Callable, Dict, Sequence, List, Optional  # noqa
+
+__all__ = ('SubmissionRecord', 'ExecutorMetrics', 'add_executor_listener',
+           'remove_executor_listener')
+
+logger = logging.getLogger(__name__)
+
+#: the registered listeners; checked on every executor submission, so this is kept as a list that
+#: is empty when instrumentation is disabled
+_listeners = []  # type: List[Callable[[SubmissionRecord], None]]
+
+
+class SubmissionRecord(namedtuple('SubmissionRecord', ['call_site', 'executor', 'submitted',
+                                                       'started', 'finished'])):
+    """
+    Timing information about a single call submitted to an executor.
+
+    The timestamps are taken from :func:`time.perf_counter`.
+
+    .. attribute:: call_site
+
+        a description of the function or the code location the call was made for
+
+    .. attribute:: executor
+
+        the executor the call was submitted to (``None`` for the event loop's default executor)
+
+    .. attribute:: submitted
+
+        the time the call was submitted
+
+    .. attribute:: started
+
+        the time the call started running in a worker thread (for calls to process pools, whose
+        start cannot be observed, this is the same as ``submitted``)
+
+    .. attribute:: finished
+
+        the time the call finished
+    """
+
+    __slots__ = ()
+
+    @property
+    def queue_wait(self) -> float:
+        """The number of seconds the call spent waiting to be run."""
+        return self.started - self.submitted
+
+    @property
+    def run_time(self) -> float:
+        """The number of seconds the call spent running."""
+        return self.finished - self.started
+
+
+def _describe(obj) -> str:
+    if isinstance(obj, str):
+        return obj
+    elif isinstance(obj, FrameType):
+        return '{}:{}'.format(obj.f_code.co_filename, obj.f_lineno)
+
+    while isinstance(obj, partial):
+        obj = obj.func
+
+    qualname = getattr(obj, '__qualname__', None) or repr(obj)
+    module = getattr(obj, '__module__', None)
+    return '{}.{}'.format(module, qualname) if module else qualname
+
+
+class _InstrumentedCall:
+    __slots__ = 'func', 'call_site', 'executor', 'listeners', 'submitted'
+
+    def __init__(self, func: Callable, call_site, executor) -> None:
+        self.func = func
+        self.call_site = _describe(call_site)
+        self.executor = executor
+        self.listeners = tuple(_listeners)
+        self.submitted = time.perf_counter()
+
+    def __call__(self):
+        # This is run in the worker thread
+        started = time.perf_counter()
+        try:
+            return self.func()
+        finally:
+            self.report(started, time.perf_counter())
+
+    def future_done(self, future) -> None:
+        # Used in place of wrapping the call when it is run in another process
+        if not future.cancelled():
+            self.report(self.submitted, time.perf_counter())
+
+    def report(self, started: float, finished: float) -> None:
+        record = SubmissionRecord(self.call_site, self.executor, self.submitted, started, finished)
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception:
+                logger.exception('Error in executor listener %r', listener)
+
+
+def add_executor_listener(listener: Callable[[SubmissionRecord], None]) -> None:
+    """
+    Register a callable to be notified of every call submitted to an executor by this library.
+
+    The listener is called in the worker thread, right after each call finishes, with a
+    :class:`SubmissionRecord` as the only argument. It must be thread safe and fast. Calls to
+    process pools are not wrapped, as the listeners would have to be sent to the worker process;
+    they are reported in the event loop thread once their results have arrived instead, with the
+    time spent waiting for a worker process counted as run time.
+
+    Calls submitted before the listener was added are not reported. When no listeners are
+    registered, the overhead of this facility is a single check per submission.
+
+    :param listener: a callable taking a single argument
+
+    """
+    _listeners.append(listener)
+
+
+def remove_executor_listener(listener: Callable[[SubmissionRecord], None]) -> None:
+    """
+    Remove a previously registered executor listener.
+
+    :param listener: a callable previously passed to :func:`add_executor_listener`
+    :raises ValueError: if the listener was not registered
+
+    """
+    _listeners.remove(listener)
+
+
+def _percentile(sorted_values: Sequence[float], percentile: float) -> float:
+    index = max(int(round(percentile / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+
+class ExecutorMetrics:
+    """
+    An executor listener that collects queue wait and run times per call site.
+
+    Example::
+
+        metrics = ExecutorMetrics()
+        add_executor_listener(metrics)
+        ...
+        for call_site, stats in metrics.summary().items():
+            print(call_site, stats['count'], stats['queue_wait'][99], stats['run_time'][99])
+
+    :param max_samples: the number of most recent samples to keep per call site
+    """
+
+    __slots__ = 'max_samples', '_samples', '_counts', '_lock'
+
+    def __init__(self, max_samples: int = 10000) -> None:
+        self.max_samples = max_samples
+        self._samples = {}  # type: Dict[str, deque]
+        self._counts = {}  # type: Dict[str, int]
+        self._lock = Lock()
+
+    def __call__(self, record: SubmissionRecord) -> None:
+        with self._lock:
+            samples = self._samples.get(record.call_site)
+            if samples is None:
+                samples = self._samples[record.call_site] = deque(maxlen=self.max_samples)
+
+            samples.append((record.queue_wait, record.run_time))
+            self._counts[record.call_site] = self._counts.get(record.call_site, 0) + 1
+
+    def reset(self) -> None:
+        """Discard all collected samples."""
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+    def summary(self, percentiles: Sequence[float] = (50, 90, 99, 100)) -> Dict[str, dict]:
+        """
+        Return percentiles of the collected queue wait and run times.
+
+        The returned dictionary maps each call site to a dictionary with the following keys:
+
+        * ``count``: the total number of calls recorded
+        * ``queue_wait``: a dictionary mapping each percentile to seconds spent waiting in queue
+        * ``run_time``: a dictionary mapping each percentile to seconds spent running
+
+        The percentiles are computed from the most recent ``max_samples`` calls.
+
+        :param percentiles: the percentiles to compute
+        :return: a dictionary of statistics per call site
+
+        """
+        with self._lock:
+            snapshot = [(call_site, list(samples), self._counts[call_site])
+                        for call_site, samples in self._samples.items()]
+
+        summary = {}
+        for call_site, samples, count in snapshot:
+            queue_waits = sorted(sample[0] for sample in samples)
+            run_times = sorted(sample[1] for sample in samples)
+            summary[call_site] = {
+                'count': count,
+                'queue_wait': {p: _percentile(queue_waits, p) for p in percentiles},
+                'run_time': {p: _percentile(run_times, p) for p in percentiles}
+            }
+
+        return summary
@@ -0,0 +1,209 @@
+import os
+import pickle
+from asyncio import get_event_loop
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import wraps, partial
+from inspect import iscoroutinefunction
+from threading import Lock
+from typing import Callable, Union, Optional
+
+from asyncio_extras.threads import _submit, _get_running_loop
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python 3.7 and earlier
+    resource_tracker = shared_memory = None
+
+__all__ = ('processpool', 'call_in_process')
+
+_default_executor = None  # type: Optional[ProcessPoolExecutor]
+_default_executor_lock = Lock()
+
+
+def _get_default_executor() -> ProcessPoolExecutor:
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ProcessPoolExecutor()
+
+        return _default_executor
+
+
+class _SharedMemoryResult:
+    """
+    Refers to a pickled return value passed back from a worker process in a shared memory block.
+
+    The copy unpickled in the calling process owns the block. It unlinks the block when the value
+    is loaded, or when it is discarded without being loaded (as happens when the awaiting task is
+    cancelled while the call is running).
+    """
+
+    __slots__ = 'name', 'size', 'owner'
+
+    def __init__(self, name: str, size: int, owner: bool = False) -> None:
+        self.name = name
+        self.size = size
+        self.owner = owner
+
+    def __reduce__(self):
+        return type(self), (self.name, self.size, True)
+
+    def __del__(self):
+        if self.owner:
+            self.owner = False
+            try:
+                block = shared_memory.SharedMemory(self.name)
+            except FileNotFoundError:
+                return
+
+            block.close()
+            block.unlink()
+
+    def load(self):
+        self.owner = False
+        block = shared_memory.SharedMemory(self.name)
+        try:
+            return pickle.loads(block.buf[:self.size])
+        finally:
+            block.close()
+            block.unlink()
+
+
+def _run_pickled(payload: bytes, shared_memory_threshold: Optional[int]):
+    # This is run in the worker process
+    func, args, kwargs = pickle.loads(payload)
+    if getattr(func, '_processpool_wrapper', False):
+        # Call the original function directly instead of relying on the wrapper to detect that it
+        # is in a worker process; a forked worker may see a copy of the parent's event loop
+        func = func.__wrapped__
+
+    retval = func(*args, **kwargs)
+    try:
+        data = pickle.dumps(retval, pickle.HIGHEST_PROTOCOL)
+    except Exception as exc:
+        raise TypeError('the return value of {!r} could not be pickled: {}'.format(func, exc)) \
+            from None
+
+    if shared_memory_threshold is None or len(data) < shared_memory_threshold:
+        return data
+
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        block.buf[:len(data)] = data
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+
+    # Ownership of the memory block passes to the parent process which unlinks it
+    block.close()
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return _SharedMemoryResult(block.name, len(data))
+
+
+def _load_result(result: Union[bytes, _SharedMemoryResult]):
+    if isinstance(result, _SharedMemoryResult):
+        return result.load()
+    else:
+        return pickle.loads(result)
+
+
+async def call_in_process(func: Callable, *args, executor: Union[Executor, str] = None,
+                          shared_memory_threshold: int = None, **kwargs):
+    """
+    Call the given callable in a worker process.
+
+    The callable and its arguments are pickled in the calling thread, so any pickling errors are
+    raised immediately as a :exc:`TypeError`. Likewise, if the return value cannot be pickled in
+    the worker process, a :exc:`TypeError` is raised.
+
+    If no executor is given, a :class:`~concurrent.futures.ProcessPoolExecutor` shared by all
+    calls is used. Its worker processes are kept running between calls, so the cost of starting
+    them and importing modules is only paid once.
+
+    If ``shared_memory_threshold`` is given, return values whose pickled size reaches this many
+    bytes are passed back to the calling process through a shared memory block instead of the
+    executor's result pipe. This requires Python 3.8 or later on a POSIX system.
+
+    If you need to pass keyword arguments named ``func``, ``executor`` or
+    ``shared_memory_threshold`` to the callable, use :func:`functools.partial` for that.
+
+    :param func: a picklable callable (e.g. a function defined at module level)
+    :param args: positional arguments to call with
+    :param executor: the process pool executor to call the function in, or the name of a
+        registered one
+    :param shared_memory_threshold: the size (in bytes) of pickled return values above which
+        shared memory is used to transfer them
+    :param kwargs: keyword arguments to call with
+    :return: the return value of the function call
+
+    """
+    if shared_memory_threshold is not None and (shared_memory is None or os.name != 'posix'):
+        raise RuntimeError('returning values through shared memory requires Python 3.8 or later '
+                           'on a POSIX system')
+
+    try:
+        payload = pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL)
+    except Exception as exc:
+        raise TypeError('cannot send {!r} and its arguments to a worker process: {}'.
+                        format(func, exc)) from None
+
+    executor = executor or _get_default_executor()
+    callback = partial(_run_pickled, payload, shared_memory_threshold)
+    result = await _submit(get_event_loop(), executor, callback, call_site=func)
+    return _load_result(result)
+
+
+def processpool(arg: Union[Executor, Callable] = None, *, shared_memory_threshold: int = None):
+    """
+    Return a decorator that causes the wrapped function to be run in a worker process.
+
+    This is meant for CPU intensive functions, which cannot run in parallel in worker threads due
+    to the global interpreter lock. The wrapped function must be defined at the module level so
+    that it can be pickled.
+
+    Callables wrapped with this must be used with ``await`` when called in the event loop thread.
+    In any other thread, and in the worker processes, they are called directly.
+
+    Example::
+
+        @processpool
+        def compute_checksum(data: bytes) -> int:
+            return do_something_cpu_intensive(data)
+
+        async def request_handler(data):
+            checksum = await compute_checksum(data)
+
+    Unlike :func:`~asyncio_extras.threads.threadpool`, this cannot be used as an asynchronous
+    context manager, as code blocks cannot be moved to another process.
+
+    :param arg: either a callable (when used as a decorator) or a process pool executor in which
+        to run the wrapped callable (see :func:`call_in_process`)
+    :param shared_memory_threshold: see :func:`call_in_process`
+
+    """
+    def decorate(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _get_running_loop() is None:
+                # No event loop running -- we're in a worker thread or process
+                return func(*args, **kwargs)
+            else:
+                # The wrapper is sent to the worker process instead of func, since func cannot be
+                # pickled by reference when its module attribute has been replaced by the wrapper
+                return call_in_process(wrapper, *args, executor=executor,
+                                       shared_memory_threshold=shared_memory_threshold, **kwargs)
+
+        assert not iscoroutinefunction(func), \
+            'Cannot wrap coroutine functions to be run in a worker process'
+        wrapper._processpool_wrapper = True
+        return wrapper
+
+    if callable(arg):
+        # When used like @processpool
+        executor = None
+        return decorate(arg)
+    else:
+        # When used like @processpool(...)
+        executor = arg
+        return decorate
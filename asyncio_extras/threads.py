@@ -1,12 +1,23 @@
 import concurrent.futures
 import gc
 import inspect
-from asyncio import get_event_loop, Future, AbstractEventLoop
-from concurrent.futures import Executor
+from asyncio import (
+    get_event_loop, ensure_future, gather, wait, run_coroutine_threadsafe, Future,
+    AbstractEventLoop, Task, Queue, FIRST_COMPLETED, CancelledError)
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
 from functools import wraps, partial
 from inspect import isawaitable
-from threading import Event
-from typing import Optional, Callable, Union
+from threading import Event, Lock, Semaphore, local
+from time import monotonic
+from typing import (  # noqa
+    Optional, Callable, Union, Hashable, Dict, Tuple, Iterable, Iterator, List)
+
+from async_generator import async_generator, yield_
+
+from asyncio_extras import instrumentation
+from asyncio_extras import executors
+from asyncio_extras.executors import DeadlineExceeded, ExecutorOverloaded, get_executor
 
 try:
     from asyncio import _get_running_loop
@@ -17,14 +28,417 @@ except ImportError:
         except RuntimeError:
             return None
 
-__all__ = ('threadpool', 'call_in_executor', 'call_async')
+try:
+    from typing import AsyncIterable
+except ImportError:  # Python 3.5.1 and earlier
+    from collections.abc import AsyncIterable
+
+try:
+    from asyncio import current_task
+except ImportError:  # Python 3.6 and earlier
+    current_task = Task.current_task
+
+__all__ = ('threadpool', 'call_in_executor', 'map_in_executor', 'iterate_in_executor',
+           'call_async', 'call_async_batch', 'LoopPortal', 'set_default_executor', 'CancelToken',
+           'get_cancel_token')
+
+_default_executor = None  # type: Optional[Executor]
+
+
+#: maps (event loop, executor, affinity key) to the queue of pending calls for that key; an entry
+#: only exists while a worker thread is draining the queue
+_affinity_queues = {}  # type: Dict[Tuple[AbstractEventLoop, Optional[Executor], Hashable], deque]
+_affinity_lock = Lock()
+
+#: holds the cancel token of the call being run in the current worker thread
+_local = local()
+
+
+class CancelToken:
+    """
+    Tells code running in a worker thread if the task waiting for it has been cancelled.
+
+    Code running in a worker thread cannot be interrupted, but long running functions can check
+    the token of the current call (see :func:`get_cancel_token`) periodically and stop early once
+    the result is no longer wanted.
+    """
+
+    __slots__ = '_future', '_cancelled'
+
+    def __init__(self) -> None:
+        self._future = None  # type: Optional[Future]
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        """``True`` if the call's result is no longer wanted."""
+        if self._cancelled:
+            return True
+
+        future = self._future
+        return future is not None and future.cancelled()
+
+    def cancel(self) -> None:
+        """Mark the token as cancelled."""
+        self._cancelled = True
+
+    def raise_if_cancelled(self) -> None:
+        """Raise :exc:`~asyncio.CancelledError` if the token has been cancelled."""
+        if self.cancelled:
+            raise CancelledError
+
+
+class _CancellableCall:
+    __slots__ = 'func', 'token', 'future'
+
+    def __init__(self, func: Callable, token: CancelToken,
+                 future: '_GuardedFuture' = None) -> None:
+        self.func = func
+        self.token = token
+        self.future = future
+
+    def __call__(self):
+        # This is run in the worker thread
+        if self.future is not None and not self.future.start():
+            return None
+
+        previous_token = getattr(_local, 'cancel_token', None)
+        _local.cancel_token = self.token
+        try:
+            return self.func()
+        finally:
+            _local.cancel_token = previous_token
+
+
+def get_cancel_token() -> CancelToken:
+    """
+    Return the cancel token of the call currently running in this worker thread.
+
+    This works in functions run by :func:`threadpool`, :func:`call_in_executor` and the other
+    functions in this library that run code in thread pool executors, including
+    ``async with threadpool()`` blocks. Elsewhere, a token that is never cancelled is returned.
+
+    Example::
+
+        @threadpool
+        def process_rows(rows):
+            token = get_cancel_token()
+            for row in rows:
+                token.raise_if_cancelled()
+                process_row(row)
+
+    """
+    token = getattr(_local, 'cancel_token', None)
+    return token if token is not None else CancelToken()
+
+
+def _set_result(future: Future, result) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: Future, exc: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exc)
+
+
+def _call_and_resolve(loop: AbstractEventLoop, func: Callable, future: Future) -> None:
+    # This is run in the worker thread
+    if future.done():
+        return
+
+    try:
+        result = func()
+    except BaseException as exc:
+        callback = partial(_set_exception, future, exc)
+    else:
+        callback = partial(_set_result, future, result)
+
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass  # the event loop has been closed
+
+
+def _run_affinity_queue(loop: AbstractEventLoop, key: tuple, queue: deque) -> None:
+    # This is run in the worker thread and keeps it until the queue has been emptied
+    while True:
+        with _affinity_lock:
+            if not queue:
+                del _affinity_queues[key]
+                return
+
+            func, future = queue.popleft()
+
+        _call_and_resolve(loop, func, future)
+
+
+def _submit(loop: AbstractEventLoop, executor: Union[Executor, str, None], func: Callable,
+            affinity: Hashable = None, call_site=None, cancel_token: CancelToken = None,
+            future: '_GuardedFuture' = None, deadline: float = None) -> Future:
+    """
+    Submit a call to the given executor.
+
+    If an affinity key is given, all calls made with the same key (and executor) are run one at a
+    time, in the order they were submitted. While there are calls pending for a key, they are all
+    run in the same worker thread. Other work can still use the rest of the executor's threads.
+
+    Cancelling the returned future before the call has started prevents it from being run. Calls
+    to thread pools can observe the cancellation of the future after they have started through
+    :func:`get_cancel_token`.
+
+    If a deadline is given and the call has not started by then, the future fails with
+    :exc:`~asyncio_extras.executors.DeadlineExceeded` and the call is not run. If the executor
+    was registered with a queue length limit that has been reached,
+    :exc:`~asyncio_extras.executors.ExecutorOverloaded` is raised right away.
+
+    :param loop: the event loop in whose thread this is being called
+    :param executor: the executor to submit to, or the name of a registered executor (``None`` =
+        the executor set with :func:`set_default_executor`, or the event loop's default executor)
+    :param func: a callable taking no arguments
+    :param affinity: an optional hashable key
+    :param call_site: a string, callable or frame identifying the call to executor listeners
+        (defaults to ``func``)
+    :param cancel_token: the cancel token to make available to the call (a new one is created by
+        default, except for process pools which cannot use one)
+    :param future: the future to resolve with the outcome of the call (a new one is created by
+        default)
+    :param deadline: the number of seconds the call may wait before starting
+    :return: a future that will resolve to the return value of the call
+
+    """
+    if executor is None:
+        executor = _default_executor
+    elif isinstance(executor, str):
+        executor = get_executor(executor)
+
+    if deadline is not None and isinstance(executor, ProcessPoolExecutor):
+        raise ValueError('deadlines are only supported for thread pool executors')
+
+    queue_limit = executors._queue_limits.get(executor) if executors._queue_limits else None
+    if queue_limit is not None and not queue_limit.acquire():
+        raise ExecutorOverloaded('too many calls are queued for {!r}'.format(executor))
+
+    instrumented = None
+    if instrumentation._listeners:
+        instrumented = instrumentation._InstrumentedCall(func, call_site or func, executor)
+        if not isinstance(executor, ProcessPoolExecutor):
+            func = instrumented
+
+    if not isinstance(executor, ProcessPoolExecutor):
+        if cancel_token is None:
+            cancel_token = CancelToken()
+
+        if future is None and (deadline is not None or queue_limit is not None):
+            future = _GuardedFuture(loop, cancel_token)
+
+        func = _CancellableCall(func, cancel_token, future)
+        if future is not None:
+            if deadline is not None:
+                future.set_deadline(deadline)
+            if queue_limit is not None:
+                future.set_queue_limit(queue_limit)
+
+    try:
+        result_future = _dispatch(loop, executor, func, affinity, future)
+    except BaseException:
+        if future is not None:
+            with future.lock:
+                future._release_queue_slot()
+        elif queue_limit is not None:
+            queue_limit.release()
+
+        raise
+
+    if deadline is not None:
+        # Only now, so that a failed dispatch leaves no timer behind to fail the future
+        future.schedule_expiry(loop)
+
+    if cancel_token is not None:
+        cancel_token._future = result_future
+    else:
+        # Calls cannot be followed into worker processes, so they are tracked from this end
+        if queue_limit is not None:
+            # They count as queued until done
+            result_future.add_done_callback(lambda future: queue_limit.release())
+        if instrumented is not None:
+            result_future.add_done_callback(instrumented.future_done)
+
+    return result_future
+
+
+def _dispatch(loop: AbstractEventLoop, executor: Optional[Executor], func: Callable,
+              affinity: Hashable, future: Optional[Future]) -> Future:
+    if affinity is None:
+        if future is None:
+            return loop.run_in_executor(executor, func)
+        elif executor is None and getattr(loop, '_default_executor', None) is None:
+            # Let the event loop create its default executor
+            loop.run_in_executor(None, _call_and_resolve, loop, func, future)
+        else:
+            # Submitting directly saves the event loop from being notified twice
+            (executor or loop._default_executor).submit(_call_and_resolve, loop, func, future)
+
+        return future
+
+    if future is None:
+        future = loop.create_future()
+
+    key = loop, executor, affinity
+    with _affinity_lock:
+        queue = _affinity_queues.get(key)
+        start_worker = queue is None
+        if start_worker:
+            queue = _affinity_queues[key] = deque()
+
+        queue.append((func, future))
+
+    if start_worker:
+        loop.run_in_executor(executor, _run_affinity_queue, loop, key, queue)
+
+    return future
+
+
+def set_default_executor(executor: Optional[Executor]) -> None:
+    """
+    Set the executor used by this library when no executor has been explicitly specified.
+
+    This affects :func:`threadpool`, :func:`call_in_executor`, :func:`map_in_executor` and
+    :func:`iterate_in_executor`. The asynchronous file operations use the executor named ``io`` by
+    default instead (see :func:`~asyncio_extras.executors.register_executor`). Unlike
+    :meth:`~asyncio.AbstractEventLoop.set_default_executor`, this accepts any executor, such as
+    :class:`~asyncio_extras.executors.AdaptiveThreadPoolExecutor`, and applies to all event loops.
+
+    :param executor: a thread pool executor, or ``None`` to revert to using the event loop's
+        default executor
+
+    """
+    global _default_executor
+    _default_executor = executor
+
+
+def _call_in_thread(executor: Union[Executor, str, None], affinity: Hashable, func: Callable,
+                    args: tuple, kwargs: dict, deadline: float = None):
+    """
+    Call the given function directly if in a worker thread, or submit it to the executor if in the
+    event loop thread.
+
+    :return: the return value of the call, or a future if it was submitted to the executor
+
+    """
+    try:
+        loop = get_event_loop()
+    except RuntimeError:
+        # Event loop not available -- we're in a worker thread
+        return func(*args, **kwargs)
+    else:
+        return _submit(loop, executor, partial(func, *args, **kwargs), affinity,
+                       deadline=deadline)
+
+
+def _find_coroutine(frame):
+    """
+    Return the coroutine object that will resume the given suspended frame.
+
+    If the frame is being run by an asyncio task, the task's own coroutine is returned. Sending to
+    it resumes the entire ``await`` chain down to the frame, just like the task itself would do.
+    Finding it this way costs the same regardless of how many objects are alive.
+
+    Otherwise, the garbage collector is searched for the coroutine which owns the frame.
+
+    """
+    task = current_task()
+    if task is not None:
+        try:
+            return task.get_coro()
+        except AttributeError:  # Python 3.7 and earlier
+            return task._coro
+
+    return next(obj for obj in gc.get_referrers(frame.f_code)
+                if inspect.iscoroutine(obj) and obj.cr_frame is frame)
+
+
+class _GuardedFuture(Future):
+    """
+    A future for a call that is only started if the future is still pending at that point.
+
+    The worker thread calls :meth:`start` right before making the call. Once the call has started,
+    the deadline no longer applies and the call's queue slot is released.
+
+    Futures of ``async with threadpool()`` blocks are created with ``cancel_running=False``:
+    once the block has started, the worker thread is running the task's coroutine, so cancelling
+    only sets the cancel token and the task is cancelled after the block has exited.
+    """
+
+    __slots__ = 'lock', 'started', 'cancel_token', 'cancel_running', 'expires', 'queue_limit'
+
+    def __init__(self, loop: AbstractEventLoop, cancel_token: CancelToken,
+                 cancel_running: bool = True) -> None:
+        super().__init__(loop=loop)
+        self.lock = Lock()
+        self.started = False
+        self.cancel_token = cancel_token
+        self.cancel_running = cancel_running
+        self.expires = None  # type: Optional[float]
+        self.queue_limit = None  # type: executors._QueueLimit
+
+    def start(self) -> bool:
+        # This is run in the worker thread
+        with self.lock:
+            if self.done():
+                return False
+            elif self.expires is not None and monotonic() >= self.expires:
+                # The event loop has not gotten around to expiring the future yet
+                raise DeadlineExceeded('the call could not be started before its deadline')
+
+            self.started = True
+            self._release_queue_slot()
+            return True
+
+    def cancel(self, *args, **kwargs) -> bool:
+        with self.lock:
+            if self.started and not self.cancel_running:
+                self.cancel_token.cancel()
+                return False
+
+            return super().cancel(*args, **kwargs)
+
+    def set_deadline(self, deadline: float) -> None:
+        self.expires = monotonic() + deadline
+
+    def schedule_expiry(self, loop: AbstractEventLoop) -> None:
+        handle = loop.call_later(self.expires - monotonic(), self._expire)
+        self.add_done_callback(lambda future: handle.cancel())
+
+    def set_queue_limit(self, queue_limit) -> None:
+        self.queue_limit = queue_limit
+        self.add_done_callback(self._done)
+
+    def _expire(self) -> None:
+        with self.lock:
+            if not self.started and not self.done():
+                self.set_exception(DeadlineExceeded('the call could not be started before its '
+                                                    'deadline'))
+
+    def _done(self, future: Future) -> None:
+        with self.lock:
+            self._release_queue_slot()
+
+    def _release_queue_slot(self) -> None:
+        # Must be called with the lock held
+        if self.queue_limit is not None:
+            self.queue_limit.release()
+            self.queue_limit = None
 
 
 class _ThreadSwitcher:
-    __slots__ = 'executor', 'exited'
+    __slots__ = 'executor', 'affinity', 'deadline', 'exited'
 
-    def __init__(self, executor: Optional[Executor]) -> None:
+    def __init__(self, executor: Union[Executor, str, None], affinity: Hashable = None,
+                 deadline: float = None) -> None:
         self.executor = executor
+        self.affinity = affinity
+        self.deadline = deadline
         self.exited = False
 
     def __aenter__(self):
@@ -45,11 +459,12 @@ class _ThreadSwitcher:
         else:
             # This is run in the event loop thread
             previous_frame = inspect.currentframe().f_back
-            coro = next(obj for obj in gc.get_referrers(previous_frame.f_code)
-                        if inspect.iscoroutine(obj) and obj.cr_frame is previous_frame)
+            coro = _find_coroutine(previous_frame)
             event = Event()
             loop = get_event_loop()
-            future = loop.run_in_executor(self.executor, exec_when_ready)
+            future = _GuardedFuture(loop, CancelToken(), cancel_running=False)
+            _submit(loop, self.executor, exec_when_ready, self.affinity, previous_frame,
+                    future.cancel_token, future, self.deadline)
             next(future.__await__())  # Make the future think it's being awaited on
             loop.call_soon(event.set)
             yield future
@@ -62,27 +477,23 @@ class _ThreadSwitcher:
     def __call__(self, func: Callable) -> Callable:
         @wraps(func)
         def wrapper(*args, **kwargs):
-            try:
-                loop = get_event_loop()
-            except RuntimeError:
-                # Event loop not available -- we're in a worker thread
-                return func(*args, **kwargs)
-            else:
-                callback = partial(func, *args, **kwargs)
-                return loop.run_in_executor(self.executor, callback)
+            return _call_in_thread(self.executor, self.affinity, func, args, kwargs,
+                                   self.deadline)
 
         assert not inspect.iscoroutinefunction(func), \
             'Cannot wrap coroutine functions to be run in an executor'
         return wrapper
 
 
-def threadpool(arg: Union[Executor, Callable] = None):
+def threadpool(arg: Union[Executor, str, Callable] = None, *, affinity: Hashable = None,
+               deadline: float = None):
     """
     Return a decorator/asynchronous context manager that guarantees that the wrapped function or
     ``with`` block is run in the given executor.
 
     If no executor is given, the current event loop's default executor is used.
-    Otherwise, the executor must be a PEP 3148 compliant thread pool executor.
+    Otherwise, the executor must be a PEP 3148 compliant thread pool executor, or the name of one
+    registered with :func:`~asyncio_extras.executors.register_executor`.
 
     Callables wrapped with this must be used with ``await`` when called in the event loop thread.
     They can also be called in worker threads, just by omitting the ``await``.
@@ -106,8 +517,28 @@ def threadpool(arg: Union[Executor, Callable] = None):
 
             await http_post(out_url, page)
 
-    :param arg: either a callable (when used as a decorator) or an executor in which to run the
-        wrapped callable or the ``with`` block (when used as a context manager)
+    If an affinity key is given, all calls and ``with`` blocks sharing that key (and executor) are
+    run one at a time in the order they were started, and are kept on the same worker thread for
+    as long as there is work pending for the key. This is useful for objects that are not safe to
+    use from several threads at once, like database connections::
+
+        async def store_results(connection, results):
+            async with threadpool(affinity=connection):
+                connection.executemany('INSERT INTO results VALUES (?)', results)
+
+    If a deadline is given, calls and ``with`` blocks that have not been started by a worker thread
+    within that many seconds are abandoned and
+    :exc:`~asyncio_extras.executors.DeadlineExceeded` is raised in their place. This keeps work
+    whose results would arrive too late to be useful from piling up in an overloaded executor::
+
+        async def request_handler(request):
+            async with threadpool('db', deadline=0.5):
+                rows = fetch_rows(request.connection)
+
+    :param arg: either a callable (when used as a decorator) or an executor (or executor name) in
+        which to run the wrapped callable or the ``with`` block (when used as a context manager)
+    :param affinity: a hashable key for serializing work on a single worker thread
+    :param deadline: the number of seconds a call or ``with`` block may wait for a worker thread
 
     """
     if callable(arg):
@@ -115,10 +546,11 @@ def threadpool(arg: Union[Executor, Callable] = None):
         return _ThreadSwitcher(None)(arg)
     else:
         # When used like @threadpool(...) or async with threadpool(...)
-        return _ThreadSwitcher(arg)
+        return _ThreadSwitcher(arg, affinity, deadline)
 
 
-def call_in_executor(func: Callable, *args, executor: Executor = None, **kwargs) -> Future:
+def call_in_executor(func: Callable, *args, executor: Union[Executor, str] = None,
+                     deadline: float = None, **kwargs) -> Future:
     """
     Call the given callable in an executor.
 
@@ -126,25 +558,206 @@ def call_in_executor(func: Callable, *args, executor: Executor = None, **kwargs)
 
         get_event_loop().run_in_executor(executor, func, *args)
 
-    If you need to pass keyword arguments named ``func`` or ``executor`` to the callable, use
-    :func:`functools.partial` for that.
+    If you need to pass keyword arguments named ``func``, ``executor`` or ``deadline`` to the
+    callable, use :func:`functools.partial` for that.
 
     :param func: a function
     :param args: positional arguments to call with
-    :param executor: the executor to call the function in
+    :param executor: the executor to call the function in, or the name of a registered executor
+    :param deadline: the number of seconds the call may wait for a worker thread before it is
+        abandoned and :exc:`~asyncio_extras.executors.DeadlineExceeded` is raised (not supported
+        for process pool executors)
     :param kwargs: keyword arguments to call with
     :return: a future that will resolve to the function call's return value
 
     """
     callback = partial(func, *args, **kwargs)
-    return get_event_loop().run_in_executor(executor, callback)
+    return _submit(get_event_loop(), executor, callback, deadline=deadline)
+
+
+def _map_chunk(func: Callable, chunk: list) -> list:
+    return [func(item) for item in chunk]
+
+
+@async_generator
+async def map_in_executor(func: Callable, iterable: Union[Iterable, AsyncIterable], *,
+                          executor: Union[Executor, str] = None, max_concurrency: int = 10,
+                          ordered: bool = True, chunksize: int = 1):
+    """
+    Call the given callable in an executor for every item in an iterable.
+
+    Items are taken from the iterable only as fast as they are processed, and no more than
+    ``max_concurrency`` calls are submitted to the executor at any time, so the iterable can be
+    arbitrarily large. To reduce per-call overhead, ``chunksize`` items can be processed in each
+    call submitted to the executor.
+
+    Example::
+
+        async def print_checksums(paths):
+            async for checksum in map_in_executor(compute_checksum, paths, max_concurrency=4):
+                print(checksum)
+
+    :param func: a function taking a single argument
+    :param iterable: an iterable or asynchronous iterable of arguments to call ``func`` with
+    :param executor: the executor to call the function in, or the name of a registered executor
+    :param max_concurrency: the maximum number of calls in the executor at any time
+    :param ordered: ``True`` to yield results in the order of the input items, ``False`` to yield
+        them as soon as they are available
+    :param chunksize: the number of items to process per submitted call
+    :return: an asynchronous iterator yielding the return values of the calls
+
+    """
+    if max_concurrency < 1:
+        raise ValueError('max_concurrency must be at least 1')
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+
+    async def next_chunk() -> list:
+        chunk = []
+        if aiterator is not None:
+            for _ in range(chunksize):
+                try:
+                    chunk.append(await aiterator.__anext__())
+                except StopAsyncIteration:
+                    break
+        else:
+            for item in iterator:
+                chunk.append(item)
+                if len(chunk) == chunksize:
+                    break
+
+        return chunk
+
+    if hasattr(iterable, '__aiter__'):
+        aiterator, iterator = iterable.__aiter__(), None
+    else:
+        aiterator, iterator = None, iter(iterable)
+
+    loop = get_event_loop()
+    pending = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_concurrency:
+                chunk = await next_chunk()
+                if chunk:
+                    callback = partial(_map_chunk, func, chunk)
+                    pending.append(_submit(loop, executor, callback, call_site=func))
+                else:
+                    exhausted = True
+
+            if not pending:
+                return
+
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = await wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                for result in await future:
+                    await yield_(result)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@async_generator
+async def iterate_in_executor(iterable: Iterable, *, executor: Union[Executor, str] = None,
+                              batch_size: int = 1, queue_size: int = 4):
+    """
+    Iterate over a regular iterable in a worker thread.
+
+    This lets blocking iterators, like generators reading a database cursor or parsing a file, be
+    consumed without blocking the event loop. A single worker thread runs the iteration and hands
+    the items over to the event loop thread through a queue of at most ``queue_size`` batches of
+    ``batch_size`` items each. When the queue is full, the worker thread waits until the consumer
+    has caught up.
+
+    Larger batches mean fewer thread switches, but items are only handed over once a full batch
+    has been collected (or the iterator is exhausted).
+
+    The worker thread is occupied until the iteration finishes. If the consumer stops iterating
+    early, the iterator is closed (if it has a ``close()`` method) in the worker thread.
+
+    Example::
+
+        def read_rows(cursor):
+            cursor.execute('SELECT * FROM big_table')
+            yield from cursor
+
+        async def process_rows(cursor):
+            async for row in iterate_in_executor(read_rows(cursor), batch_size=100):
+                await process_row(row)
+
+    :param iterable: an iterable
+    :param executor: the executor to run the iteration in, or the name of a registered executor
+    :param batch_size: the number of items to hand over to the event loop thread at once
+    :param queue_size: the maximum number of batches waiting to be consumed
+    :return: an asynchronous iterator yielding the items from ``iterable``
+
+    """
+    def produce() -> None:
+        # This is run in the worker thread
+        def send(batch: list, exception: BaseException = None, finished: bool = False) -> bool:
+            slots.acquire()
+            if stopped.is_set():
+                return False
+
+            loop.call_soon_threadsafe(queue.put_nowait, (batch, exception, finished))
+            return True
+
+        iterator = None
+        batch = []
+        try:
+            iterator = iter(iterable)
+            for item in iterator:
+                batch.append(item)
+                if len(batch) == batch_size:
+                    if not send(batch):
+                        return
+
+                    batch = []
+        except BaseException as exc:
+            send(batch, exc, True)
+        else:
+            send(batch, None, True)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    loop = get_event_loop()
+    queue = Queue()
+    slots = Semaphore(queue_size)
+    stopped = Event()
+    future = _submit(loop, executor, produce, call_site=iterable)
+    try:
+        while True:
+            batch, exception, finished = await queue.get()
+            slots.release()
+            for item in batch:
+                await yield_(item)
+
+            if exception is not None:
+                raise exception
+            elif finished:
+                break
+    finally:
+        # Let the worker thread know it should stop, and wake it up if it's waiting for a slot
+        stopped.set()
+        slots.release()
+        await future
 
 
 def call_async(loop: AbstractEventLoop, func: Callable, *args, **kwargs):
     """
     Call the given callable in the event loop thread.
 
-    If the call returns an awaitable, it is resolved before returning to the caller.
+    If the call returns an awaitable, it is resolved before returning to the caller. Otherwise the
+    result is passed back directly, without creating a task.
 
     If you need to pass keyword arguments named ``loop`` or ``func`` to the callable, use
     :func:`functools.partial` for that.
@@ -156,19 +769,196 @@ def call_async(loop: AbstractEventLoop, func: Callable, *args, **kwargs):
     :return: the return value of the function call
 
     """
-    async def callback():
+    async def resolve(awaitable) -> None:
+        try:
+            f.set_result(await awaitable)
+        except BaseException as e:
+            f.set_exception(e)
+
+    def callback():
         try:
             retval = func(*args, **kwargs)
-            if isawaitable(retval):
-                retval = await retval
         except BaseException as e:
             f.set_exception(e)
         else:
-            f.set_result(retval)
+            if isawaitable(retval):
+                loop.create_task(resolve(retval))
+            else:
+                f.set_result(retval)
 
     if _get_running_loop():
         raise RuntimeError('call_async() must not be called from an event loop thread')
 
     f = concurrent.futures.Future()
-    loop.call_soon_threadsafe(loop.create_task, callback())
+    loop.call_soon_threadsafe(callback)
     return f.result()
+
+
+def call_async_batch(loop: AbstractEventLoop, funcs: Iterable[Callable[[], object]]) -> list:
+    """
+    Call several callables in the event loop thread, waking up the event loop only once.
+
+    Any awaitables returned by the calls are resolved concurrently. The results are returned once
+    all the calls have finished. If any of the calls raised an exception, the exception from the
+    first such call (in the order of ``funcs``) is raised instead.
+
+    Use :func:`functools.partial` to pass arguments to the callables::
+
+        results = call_async_batch(loop, [partial(fetch, url) for url in urls])
+
+    :param loop: the event loop in which to call the functions
+    :param funcs: regular functions or coroutine functions taking no arguments
+    :return: a list of the return values of the calls, in the order of ``funcs``
+
+    """
+    def resolve(_=None) -> None:
+        for index, future in awaitables.items():
+            try:
+                results[index] = future.result()
+            except BaseException as e:
+                exceptions[index] = e
+
+        if exceptions:
+            f.set_exception(exceptions[min(exceptions)])
+        else:
+            f.set_result(results)
+
+    def callback():
+        for index, func in enumerate(funcs):
+            try:
+                retval = func()
+            except BaseException as e:
+                exceptions[index] = e
+            else:
+                if isawaitable(retval):
+                    awaitables[index] = ensure_future(retval, loop=loop)
+                else:
+                    results[index] = retval
+
+        if awaitables:
+            gather(*awaitables.values(), return_exceptions=True).add_done_callback(resolve)
+        else:
+            resolve()
+
+    if _get_running_loop():
+        raise RuntimeError('call_async_batch() must not be called from an event loop thread')
+
+    funcs = list(funcs)
+    results = [None] * len(funcs)
+    exceptions = {}  # type: Dict[int, BaseException]
+    awaitables = {}  # type: Dict[int, Future]
+    f = concurrent.futures.Future()
+    loop.call_soon_threadsafe(callback)
+    return f.result()
+
+
+class _PortalContextManager:
+    __slots__ = 'portal', 'async_cm'
+
+    def __init__(self, portal: 'LoopPortal', async_cm) -> None:
+        self.portal = portal
+        self.async_cm = async_cm
+
+    def __enter__(self):
+        return self.portal.call(self.async_cm.__aenter__)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return bool(self.portal.call(self.async_cm.__aexit__, exc_type, exc_val, exc_tb))
+
+
+class LoopPortal:
+    """
+    Lets synchronous code in worker threads use asynchronous code running in an event loop.
+
+    Example::
+
+        @threadpool
+        def export_rows(loop, path):
+            portal = LoopPortal(loop)
+            with portal.enter(database.connect()) as connection, open(path, 'w') as f:
+                for row in portal.iterate(connection.fetch_rows()):
+                    f.write(format_row(row))
+
+        async def handler():
+            await export_rows(asyncio.get_event_loop(), '/tmp/rows.txt')
+
+    None of the methods may be called from the event loop thread.
+
+    :param loop: the event loop in which to run the asynchronous code
+    """
+
+    __slots__ = 'loop'
+
+    def __init__(self, loop: AbstractEventLoop) -> None:
+        self.loop = loop
+
+    def call(self, func: Callable, *args, **kwargs):
+        """
+        Call the given callable in the event loop thread.
+
+        This works just like :func:`call_async`.
+
+        :param func: a regular function or a coroutine function
+        :param args: positional arguments to call with
+        :param kwargs: keyword arguments to call with
+        :return: the return value of the function call
+
+        """
+        return call_async(self.loop, func, *args, **kwargs)
+
+    def iterate(self, aiterable: AsyncIterable, batch_size: int = 100) -> Iterator:
+        """
+        Iterate over an asynchronous iterable.
+
+        Items are fetched in the event loop in batches of up to ``batch_size``, and the next batch
+        is already being fetched while the current one is being consumed, so most items can be
+        returned without waiting for the event loop.
+
+        If the iteration is stopped early, the asynchronous iterator is closed (if it has an
+        ``aclose()`` method) after the batch currently being fetched has been completed.
+
+        :param aiterable: an asynchronous iterable
+        :param batch_size: the maximum number of items to fetch from the event loop at once
+        :return: an iterator yielding the items from ``aiterable``
+
+        """
+        async def fetch() -> tuple:
+            items = []
+            try:
+                while len(items) < batch_size:
+                    items.append(await aiterator.__anext__())
+            except StopAsyncIteration:
+                return items, None, True
+            except BaseException as exc:
+                return items, exc, True
+            else:
+                return items, None, False
+
+        aiterator = self.call(aiterable.__aiter__)
+        future = run_coroutine_threadsafe(fetch(), self.loop)
+        try:
+            while True:
+                items, exception, finished = future.result()
+                future = None if finished else run_coroutine_threadsafe(fetch(), self.loop)
+                yield from items
+                if exception is not None:
+                    raise exception
+                elif finished:
+                    return
+        finally:
+            if future is not None:
+                # The iteration was stopped early
+                future.result()
+                if hasattr(aiterator, 'aclose'):
+                    self.call(aiterator.aclose)
+
+    def enter(self, async_cm):
+        """
+        Return a synchronous context manager that enters and exits the given asynchronous context
+        manager in the event loop.
+
+        :param async_cm: an asynchronous context manager
+        :return: a regular context manager
+
+        """
+        return _PortalContextManager(self, async_cm)
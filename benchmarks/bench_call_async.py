@@ -0,0 +1,56 @@
+"""
+Measures the round trip latency of calling functions in the event loop thread from a worker thread
+with ``call_async()``.
+
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import main, measure, run_async
+
+from asyncio_extras import call_async
+
+BATCH_SIZE = 100
+
+
+def add(x, y):
+    return x + y
+
+
+async def add_async(x, y):
+    return x + y
+
+
+def _measure_in_thread(func, iterations: int) -> float:
+    async def run():
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(1) as executor:
+            return await loop.run_in_executor(executor, lambda: measure(lambda: func(loop),
+                                                                        iterations))
+
+    return run_async(run())
+
+
+def bench_call_async():
+    return {
+        'plain_function': _measure_in_thread(lambda loop: call_async(loop, add, 1, 2), 5000),
+        'coroutine_function': _measure_in_thread(lambda loop: call_async(loop, add_async, 1, 2),
+                                                 5000)
+    }
+
+
+def bench_call_async_batch():
+    from asyncio_extras import call_async_batch
+
+    calls = [lambda: add(1, 2)] * BATCH_SIZE
+    async_calls = [lambda: add_async(1, 2)] * BATCH_SIZE
+    batch = _measure_in_thread(lambda loop: call_async_batch(loop, calls), 200)
+    async_batch = _measure_in_thread(lambda loop: call_async_batch(loop, async_calls), 200)
+    return {
+        'plain_function_per_call': batch / BATCH_SIZE,
+        'coroutine_function_per_call': async_batch / BATCH_SIZE
+    }
+
+
+if __name__ == '__main__':
+    main(globals())
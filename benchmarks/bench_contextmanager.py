@@ -0,0 +1,51 @@
+"""
+Measures the cost of entering and exiting context managers made with ``async_contextmanager``,
+compared to a hand written asynchronous context manager class.
+
+"""
+from harness import main, measure_async, run_async
+
+from asyncio_extras import async_contextmanager
+
+
+class HandWritten:
+    async def __aenter__(self):
+        return 1
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+@async_contextmanager
+async def native_generator():
+    yield 1
+
+
+def bench_enter_exit():
+    async def hand_written():
+        async with HandWritten():
+            pass
+
+    async def decorated():
+        async with native_generator():
+            pass
+
+    async def decorated_exception():
+        try:
+            async with native_generator():
+                raise ValueError
+        except ValueError:
+            pass
+
+    async def run():
+        return {
+            'hand_written': await measure_async(hand_written, 20000),
+            'async_contextmanager': await measure_async(decorated, 20000),
+            'async_contextmanager_exception': await measure_async(decorated_exception, 20000)
+        }
+
+    return run_async(run())
+
+
+if __name__ == '__main__':
+    main(globals())
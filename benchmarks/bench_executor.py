@@ -0,0 +1,66 @@
+"""
+Compares ``AdaptiveThreadPoolExecutor`` with fixed size thread pools under a bursty load of short
+blocking calls, alternating between small and large bursts with idle pauses in between.
+
+Reported are the mean and 99th percentile latencies from submission to result, and the number of
+worker threads each executor ends up holding after the load has passed.
+
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import run_async
+
+from asyncio_extras import AdaptiveThreadPoolExecutor, call_in_executor
+
+BURSTS = 20
+SMALL_BURST = 4
+LARGE_BURST = 64
+CALL_DURATION = 0.002
+PAUSE = 0.05
+IDLE_TIMEOUT = 0.5
+
+
+async def run_load(executor) -> list:
+    async def call():
+        start = time.perf_counter()
+        await call_in_executor(time.sleep, CALL_DURATION, executor=executor)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = []
+    for burst in range(BURSTS):
+        size = LARGE_BURST if burst % 2 else SMALL_BURST
+        await asyncio.gather(*[call() for _ in range(size)])
+        await asyncio.sleep(PAUSE)
+
+    latencies.sort()
+    return latencies
+
+
+def bench_bursty_load():
+    results = {}
+    executors = [
+        ('fixed_4', ThreadPoolExecutor(4)),
+        ('fixed_32', ThreadPoolExecutor(32)),
+        ('adaptive', AdaptiveThreadPoolExecutor(max_workers=32, idle_timeout=IDLE_TIMEOUT))
+    ]
+    for name, executor in executors:
+        with executor:
+            latencies = run_async(run_load(executor))
+            time.sleep(IDLE_TIMEOUT * 1.5)
+            if isinstance(executor, AdaptiveThreadPoolExecutor):
+                threads = executor.worker_count
+            else:
+                threads = len(executor._threads)
+
+        results[name + '_mean'] = sum(latencies) / len(latencies)
+        results[name + '_p99'] = latencies[int(len(latencies) * 0.99)]
+        results[name + '_threads_after_load_count'] = threads
+
+    return results
+
+
+if __name__ == '__main__':
+    from harness import main
+    main(globals())
@@ -0,0 +1,57 @@
+"""
+Measures the cost of opening and closing a file with ``open_async()``, and the memory retained by
+each open file wrapper.
+
+"""
+import os
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import main, measure_async, run_async
+
+from asyncio_extras import open_async
+
+OPEN_FILES = 1000
+
+
+def bench_open_close():
+    async def open_close():
+        async with open_async(path, 'rb', executor=executor):
+            pass
+
+    with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(1) as executor:
+        path = os.path.join(tmpdir, 'data')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+
+        return {'open_close': run_async(measure_async(open_close, 1000))}
+
+
+def bench_memory_per_open_file():
+    async def open_files():
+        wrappers = []
+        tracemalloc.start()
+        try:
+            for _ in range(OPEN_FILES):
+                wrappers.append(await open_async(path, 'rb', executor=executor))
+
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        for wrapper in wrappers:
+            wrapper.close()
+
+        return size / OPEN_FILES
+
+    with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(1) as executor:
+        path = os.path.join(tmpdir, 'data')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+
+        return {'wrapper_and_file_bytes': run_async(open_files())}
+
+
+if __name__ == '__main__':
+    main(globals())
@@ -0,0 +1,135 @@
+"""
+Measures file read throughput with the different reading methods of ``AsyncFileWrapper``, and the
+latency of reading small files whole.
+
+For chunked reads, the peak amount of memory allocated through Python while streaming the file is
+also measured (with :mod:`tracemalloc`), as reading into pooled buffers is meant to save memory
+rather than time.
+
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import has_feature, main, measure_async, run_async
+
+import asyncio_extras
+from asyncio_extras import open_async, AsyncFileWrapper
+
+FILE_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+LINE_FILE_LINES = 50000
+SMALL_FILE_SIZE = 4096
+
+
+def _throughput(func, data: bytes) -> float:
+    with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(4) as executor:
+        path = os.path.join(tmpdir, 'data')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            run_async(func(path, executor))
+            best = min(best, time.perf_counter() - start)
+
+        return len(data) / best / 1048576
+
+
+def _peak_memory(func, data: bytes) -> int:
+    with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(4) as executor:
+        path = os.path.join(tmpdir, 'data')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        tracemalloc.start()
+        try:
+            run_async(func(path, executor))
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+async def _readchunks(path, executor):
+    async with open_async(path, 'rb', executor=executor) as f:
+        async for chunk in f.async_readchunks(CHUNK_SIZE):
+            pass
+
+
+async def _readchunks_prefetch(path, executor):
+    async with open_async(path, 'rb', executor=executor) as f:
+        async for chunk in f.async_readchunks(CHUNK_SIZE, prefetch=2):
+            pass
+
+
+async def _readinto_chunks(path, executor):
+    pool = asyncio_extras.BufferPool(CHUNK_SIZE, 4)
+    async with open_async(path, 'rb', executor=executor) as f:
+        async for chunk in f.async_readinto_chunks(pool):
+            pool.release(chunk)
+
+
+def _chunk_readers():
+    readers = [('readchunks', _readchunks)]
+    if has_feature(AsyncFileWrapper.async_readchunks, 'prefetch'):
+        readers.append(('readchunks_prefetch', _readchunks_prefetch))
+    if has_feature(asyncio_extras, 'BufferPool'):
+        readers.append(('readinto_chunks', _readinto_chunks))
+
+    return readers
+
+
+def bench_chunk_streaming():
+    data = os.urandom(FILE_SIZE)
+    return {name + '_mib_per_second': _throughput(func, data)
+            for name, func in _chunk_readers()}
+
+
+def bench_chunk_memory():
+    data = os.urandom(FILE_SIZE)
+    return {name + '_peak_bytes': _peak_memory(func, data) for name, func in _chunk_readers()}
+
+
+def bench_line_iteration():
+    async def iterate(path, executor):
+        async for line in open_async(path, 'rb', executor=executor):
+            pass
+
+    async def iterlines(path, executor):
+        async with open_async(path, 'rb', executor=executor) as f:
+            async for line in f.async_iterlines():
+                pass
+
+    data = b''.join(b'%08d some log line contents here\n' % i for i in range(LINE_FILE_LINES))
+    results = {'async_for_mib_per_second': _throughput(iterate, data)}
+    if has_feature(AsyncFileWrapper, 'async_iterlines'):
+        results['async_iterlines_mib_per_second'] = _throughput(iterlines, data)
+
+    return results
+
+
+def bench_whole_file():
+    async def open_read():
+        async with open_async(path, 'rb', executor=executor) as f:
+            await f.read()
+
+    async def read_file():
+        await asyncio_extras.read_file_async(path, executor=executor)
+
+    with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(1) as executor:
+        path = os.path.join(tmpdir, 'data')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(SMALL_FILE_SIZE))
+
+        results = {'open_async_read': run_async(measure_async(open_read, 1000))}
+        if has_feature(asyncio_extras, 'read_file_async'):
+            results['read_file_async'] = run_async(measure_async(read_file, 1000))
+
+        return results
+
+
+if __name__ == '__main__':
+    main(globals())
@@ -0,0 +1,54 @@
+"""
+Measures the overhead of running functions in a thread pool through the library, compared to
+calling ``run_in_executor()`` directly.
+
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import has_feature, main, measure, measure_async, run_async
+
+from asyncio_extras import threadpool, call_in_executor
+
+
+def noop():
+    pass
+
+
+def bench_executor_round_trip():
+    async def run():
+        loop = asyncio.get_event_loop()
+        decorated = threadpool(executor)(noop)
+        results = {
+            'run_in_executor': await measure_async(
+                lambda: loop.run_in_executor(executor, noop), 5000),
+            'call_in_executor': await measure_async(
+                lambda: call_in_executor(noop, executor=executor), 5000),
+            'threadpool_decorator': await measure_async(decorated, 5000)
+        }
+        if has_feature(threadpool, 'affinity'):
+            results['threadpool_affinity'] = await measure_async(
+                threadpool(executor, affinity='key')(noop), 5000)
+
+        return results
+
+    with ThreadPoolExecutor(1) as executor:
+        return run_async(run())
+
+
+def bench_decorator_in_worker_thread():
+    """A decorated function called in a worker thread should cost little more than a plain call."""
+    async def run():
+        loop = asyncio.get_event_loop()
+        decorated = threadpool(noop)
+        return {
+            'plain_call': await loop.run_in_executor(executor, measure, noop, 100000),
+            'decorated_call': await loop.run_in_executor(executor, measure, decorated, 100000)
+        }
+
+    with ThreadPoolExecutor(1) as executor:
+        return run_async(run())
+
+
+if __name__ == '__main__':
+    main(globals())
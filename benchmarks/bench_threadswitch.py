@@ -0,0 +1,36 @@
+"""
+Measures the latency of entering and leaving an ``async with threadpool():`` block as the number of
+live objects on the heap grows.
+
+The cost of a block switch should stay flat regardless of the heap size.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import main, measure_async, run_async
+
+from asyncio_extras import threadpool
+
+HEAP_SIZES = (0, 100000, 1000000, 3000000)
+
+
+def bench_block_switch_vs_heap_size():
+    async def switch():
+        async with threadpool(executor):
+            pass
+
+    async def run():
+        results = {}
+        heap = []
+        for size in HEAP_SIZES:
+            heap.extend([] for _ in range(size - len(heap)))
+            results['heap_{}'.format(size)] = await measure_async(switch, 200)
+
+        return results
+
+    with ThreadPoolExecutor(1) as executor:
+        return run_async(run())
+
+
+if __name__ == '__main__':
+    main(globals())
@@ -0,0 +1,104 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+
+Each ``bench_*.py`` module defines one or more ``bench_*()`` functions returning a dictionary
+mapping result names to measured values (seconds per operation unless the name says otherwise).
+Running a module directly prints its results.
+
+"""
+import asyncio
+import gc
+import inspect
+import sys
+import time
+from typing import Callable, Dict
+
+
+def run_async(coro):
+    """Run a coroutine in a fresh event loop and close the loop afterwards."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def measure_async(func: Callable, iterations: int, repeat: int = 5) -> float:
+    """
+    Return the best per-iteration time of awaiting ``func()`` ``iterations`` times in a row.
+
+    The garbage collector is disabled while measuring.
+
+    """
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                await func()
+
+            best = min(best, (time.perf_counter() - start) / iterations)
+    finally:
+        gc.enable()
+
+    return best
+
+
+def measure(func: Callable, iterations: int, repeat: int = 5) -> float:
+    """Return the best per-iteration time of calling ``func()`` ``iterations`` times in a row."""
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+
+            best = min(best, (time.perf_counter() - start) / iterations)
+    finally:
+        gc.enable()
+
+    return best
+
+
+def has_feature(obj, name: str) -> bool:
+    """
+    Return ``True`` if ``obj`` has an attribute or accepts a parameter by the given name.
+
+    This lets benchmarks leave out the measurements of features that are missing from an older
+    release of the library, so that the rest of their results can still be compared.
+
+    """
+    if hasattr(obj, name):
+        return True
+
+    try:
+        return name in inspect.signature(obj).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def format_value(name: str, value: float) -> str:
+    if name.endswith('_bytes') or name.endswith('_count'):
+        return '{:,.0f}'.format(value)
+    elif name.endswith('_per_second'):
+        return '{:,.1f}'.format(value)
+    else:
+        return '{:.2f} us'.format(value * 1000000)
+
+
+def print_results(results: Dict[str, float], file=sys.stdout) -> None:
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print('{}  {}'.format(name.ljust(width), format_value(name, value)), file=file)
+
+
+def main(module_globals: dict) -> None:
+    """Run every ``bench_*()`` function in the given module namespace and print the results."""
+    for name, func in sorted(module_globals.items()):
+        if name.startswith('bench_') and callable(func):
+            print('{}:'.format(name))
+            print_results(func())
+            print()
@@ -0,0 +1,105 @@
+"""
+Runs the benchmark suite and optionally saves the results or compares them against earlier ones.
+
+Usage::
+
+    python benchmarks/run.py [-k SUBSTRING] [--save FILE] [--compare FILE] [--threshold RATIO]
+
+When comparing, a result is reported as a regression if it is worse than the earlier result by more
+than the threshold (0.2 = 20 % by default), and the exit status is then 1.
+
+Benchmark modules and functions that fail with :exc:`ImportError`, typically because they use
+features missing from the installed release of the library, are skipped with a notice.
+
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+from collections import OrderedDict
+
+from harness import format_value
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def iterate_benchmarks(selection: str):
+    for filename in sorted(os.listdir(BENCHMARK_DIR)):
+        if filename.startswith('bench_') and filename.endswith('.py'):
+            try:
+                module = importlib.import_module(filename[:-3])
+            except ImportError as exc:
+                print('{}: skipped ({})\n'.format(filename[:-3], exc))
+                continue
+
+            for name in sorted(dir(module)):
+                qualified_name = '{}.{}'.format(module.__name__, name)
+                func = getattr(module, name)
+                if name.startswith('bench_') and callable(func) and selection in qualified_name:
+                    yield qualified_name, func
+
+
+def is_regression(name: str, value: float, previous: float, threshold: float) -> bool:
+    if name.endswith('_per_second'):
+        return value < previous * (1 - threshold)
+    else:
+        return value > previous * (1 + threshold)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Run the asyncio_extras benchmarks')
+    parser.add_argument('-k', dest='selection', default='',
+                        help='only run benchmarks whose name contains this string')
+    parser.add_argument('--save', metavar='FILE', help='save the results to a JSON file')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results against those saved in a JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative change counted as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = OrderedDict()
+    regressions = 0
+    for benchmark_name, func in iterate_benchmarks(args.selection):
+        print('{}:'.format(benchmark_name))
+        try:
+            func_results = func()
+        except ImportError as exc:
+            print('  skipped ({})\n'.format(exc))
+            continue
+
+        for name, value in func_results.items():
+            key = '{}.{}'.format(benchmark_name, name)
+            results[key] = value
+            line = '  {:<40} {:>14}'.format(name, format_value(name, value))
+            if key in previous:
+                line += '  (was {})'.format(format_value(name, previous[key]))
+                if is_regression(name, value, previous[key], args.threshold):
+                    line += '  REGRESSION'
+                    regressions += 1
+
+            print(line)
+
+        print()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version, 'platform': platform.platform(),
+                       'results': results}, f, indent=2)
+            f.write('\n')
+
+    if regressions:
+        print('{} regression(s) found'.format(regressions))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,8 @@ import asyncio
 import pytest
 from async_generator import yield_
 
-from asyncio_extras import async_contextmanager
+from asyncio_extras import (
+    ConcurrentExitStack, async_contextmanager, pooled_async_contextmanager)
 
 
 @pytest.mark.asyncio
@@ -95,3 +96,388 @@ async def test_return_after_yield():
     async with dummycontext(2) as value:
         assert value == 2
         raise RuntimeError
+
+
+class TestPooledContextManager:
+    @pytest.fixture
+    def events(self):
+        return []
+
+    @pytest.fixture
+    def factory(self, events):
+        counter = 0
+
+        async def factory(name):
+            nonlocal counter
+            counter += 1
+            resource = '%s-%d' % (name, counter)
+            events.append(('setup', resource))
+            try:
+                await yield_(resource)
+            except Exception as exc:
+                events.append(('error', resource, str(exc)))
+                raise
+            else:
+                events.append(('teardown', resource))
+
+        return factory
+
+    @pytest.mark.asyncio
+    async def test_reuse(self, factory, events):
+        pool = pooled_async_contextmanager(factory)
+        for _ in range(3):
+            async with pool('a') as resource:
+                assert resource == 'a-1'
+
+        async with pool('b') as resource:
+            assert resource == 'b-2'
+
+        assert events == [('setup', 'a-1'), ('setup', 'b-2')]
+        assert pool.size == 2
+        assert pool.idle == 2
+
+        await pool.aclose()
+        assert sorted(events[2:]) == [('teardown', 'a-1'), ('teardown', 'b-2')]
+        assert pool.size == 0
+
+    @pytest.mark.asyncio
+    async def test_exception_evicts(self, factory, events):
+        pool = pooled_async_contextmanager(factory)
+        with pytest.raises(Exception) as exc:
+            async with pool('a'):
+                raise Exception('foo')
+
+        exc.match('^foo$')
+        async with pool('a') as resource:
+            assert resource == 'a-2'
+
+        assert events == [('setup', 'a-1'), ('error', 'a-1', 'foo'), ('setup', 'a-2')]
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_health_check(self, factory, events):
+        async def health_check(resource):
+            return resource != 'a-1'
+
+        pool = pooled_async_contextmanager(factory, health_check=health_check)
+        async with pool('a') as resource:
+            assert resource == 'a-1'
+
+        async with pool('a') as resource:
+            assert resource == 'a-2'
+
+        assert events == [('setup', 'a-1'), ('teardown', 'a-1'), ('setup', 'a-2')]
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_health_check_error(self, factory, events):
+        """Test that a resource whose health check fails is evicted, freeing its slot."""
+        async def health_check(resource):
+            if resource == 'a-1':
+                raise ConnectionError('ping failed')
+
+            return True
+
+        pool = pooled_async_contextmanager(factory, max_size=1, health_check=health_check)
+        async with pool('a'):
+            pass
+
+        with pytest.raises(ConnectionError):
+            async with pool('a'):
+                pass
+
+        assert pool.size == 0
+        async with pool('a') as resource:
+            assert resource == 'a-2'
+
+        assert events == [('setup', 'a-1'), ('teardown', 'a-1'), ('setup', 'a-2')]
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_health_check_cancelled(self, event_loop, factory, events):
+        async def health_check(resource):
+            await asyncio.sleep(1)
+
+        pool = pooled_async_contextmanager(factory, max_size=1, health_check=health_check)
+        async with pool('a'):
+            pass
+
+        task = event_loop.create_task(pool('a').__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert pool.size == 0
+        assert events == [('setup', 'a-1'), ('teardown', 'a-1')]
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_idle_ttl(self, factory, events):
+        pool = pooled_async_contextmanager(factory, min_size=1, idle_ttl=0.05)
+        async with pool('a'):
+            async with pool('a'):
+                pass
+
+        assert pool.idle == 2
+        await asyncio.sleep(0.15)
+        assert events == [('setup', 'a-1'), ('setup', 'a-2'), ('teardown', 'a-2')]
+        assert pool.idle == 1
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_fair_waiters(self, event_loop, factory, events):
+        async def use(number):
+            async with pool('a') as resource:
+                order.append((number, resource))
+                await asyncio.sleep(0.01)
+
+        order = []
+        pool = pooled_async_contextmanager(factory, max_size=1)
+        tasks = []
+        for i in range(4):
+            tasks.append(asyncio.ensure_future(use(i)))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        assert order == [(0, 'a-1'), (1, 'a-1'), (2, 'a-1'), (3, 'a-1')]
+        assert pool.size == 1
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter(self, event_loop, factory):
+        pool = pooled_async_contextmanager(factory, max_size=1)
+        async with pool('a'):
+            task = event_loop.create_task(pool('a').__aenter__())
+            await asyncio.sleep(0)
+            task.cancel()
+
+        async with pool('a') as resource:
+            assert resource == 'a-1'
+
+        assert pool.size == 1
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_decorator_arguments(self, events):
+        @pooled_async_contextmanager(max_size=2)
+        async def factory():
+            events.append('setup')
+            await yield_(object())
+
+        async with factory() as first, factory() as second:
+            assert first is not second
+            waiter = asyncio.ensure_future(factory().__aenter__())
+            await asyncio.sleep(0)
+            assert not waiter.done()
+
+        assert await waiter in (first, second)
+        assert events == ['setup', 'setup']
+        await factory.aclose()
+
+    @pytest.mark.asyncio
+    async def test_use_after_close(self, factory, events):
+        pool = pooled_async_contextmanager(factory)
+        async with pool('a'):
+            pass
+
+        await pool.aclose()
+        with pytest.raises(RuntimeError) as exc:
+            pool('a')
+
+        exc.match('^the resource pool has been closed$')
+        assert events == [('setup', 'a-1'), ('teardown', 'a-1')]
+        assert pool.size == 0
+
+    def test_unhashable_arguments(self, factory):
+        pool = pooled_async_contextmanager(factory)
+        with pytest.raises(TypeError) as exc:
+            pool(['a'])
+
+        exc.match('^the arguments of pooled resources must be hashable')
+        with pytest.raises(TypeError):
+            pool('a', option={})
+
+    @pytest.mark.asyncio
+    async def test_keyword_arguments(self, events):
+        @pooled_async_contextmanager
+        async def factory(**kwargs):
+            events.append(kwargs)
+            await yield_(kwargs)
+
+        async with factory(a=1, b='x') as first:
+            pass
+
+        async with factory(b='x', a=1) as second:
+            assert second is first
+
+        assert events == [{'a': 1, 'b': 'x'}]
+        await factory.aclose()
+
+    @pytest.mark.asyncio
+    async def test_empty_pools_discarded(self, factory, events):
+        """Test that pools are discarded once their resources have been evicted."""
+        pool = pooled_async_contextmanager(factory, idle_ttl=0.05)
+        context = pool('b')
+        for name in 'abc':
+            async with pool(name):
+                pass
+
+        assert len(pool._pools) == 3
+        await asyncio.sleep(0.15)
+        assert pool.size == 0
+        assert pool._pools == {}
+
+        # A context manager created before its pool was discarded gets a fresh pool
+        async with context as resource:
+            assert resource == 'b-4'
+
+        assert len(pool._pools) == 1
+        with pytest.raises(Exception):
+            async with pool('b'):
+                raise Exception('foo')
+
+        assert pool._pools == {}
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_min_size_retained(self, factory, events):
+        """Test that min_size only keeps resources around and does not create them."""
+        pool = pooled_async_contextmanager(factory, min_size=2, idle_ttl=0.05)
+        async with pool('a'):
+            pass
+
+        assert pool.size == 1
+        await asyncio.sleep(0.15)
+        assert pool.size == 1
+        assert events == [('setup', 'a-1')]
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_health_check_keeps_pool(self, factory, events):
+        """Test that replacing the only resource of a pool does not discard the pool."""
+        pool = pooled_async_contextmanager(factory, health_check=lambda value: value != 'a-1')
+        async with pool('a'):
+            pass
+
+        original = pool._pools[(('a',), frozenset())]
+        async with pool('a') as resource:
+            assert resource == 'a-2'
+
+        assert list(pool._pools.values()) == [original]
+        assert pool.size == 1
+        await pool.aclose()
+
+    def test_bad_sizes(self, factory):
+        pytest.raises(ValueError, pooled_async_contextmanager, factory, max_size=0)
+        pytest.raises(ValueError, pooled_async_contextmanager, factory, min_size=2, max_size=1)
+
+
+class TestConcurrentExitStack:
+    @pytest.fixture
+    def events(self):
+        return []
+
+    @pytest.fixture
+    def resource(self, events):
+        @async_contextmanager
+        async def resource(name, delay=0.05, fail=False, suppress=False):
+            events.append(('enter', name))
+            await asyncio.sleep(delay)
+            if fail:
+                raise Exception('%s failed' % name)
+
+            try:
+                await yield_(name)
+            except Exception:
+                if not suppress:
+                    raise
+            finally:
+                await asyncio.sleep(delay)
+                events.append(('exit', name))
+
+        return resource
+
+    @pytest.mark.asyncio
+    async def test_concurrent(self, event_loop, resource, events):
+        start = event_loop.time()
+        async with ConcurrentExitStack() as stack:
+            values = await stack.enter_async_contexts(resource('a'), resource('b'),
+                                                      resource('c'))
+            assert values == ['a', 'b', 'c']
+
+        assert event_loop.time() - start < 0.2
+        assert sorted(events) == [('enter', 'a'), ('enter', 'b'), ('enter', 'c'),
+                                  ('exit', 'a'), ('exit', 'b'), ('exit', 'c')]
+
+    @pytest.mark.asyncio
+    async def test_dependencies(self, resource, events):
+        async with ConcurrentExitStack() as stack:
+            a = stack.add(resource('a'))
+            b = stack.add(resource('b', delay=0.01), depends_on=[a])
+            stack.add(resource('c', delay=0.01), depends_on=[b])
+            assert await stack.enter() == ['a', 'b', 'c']
+
+        assert events == [('enter', 'a'), ('enter', 'b'), ('enter', 'c'),
+                          ('exit', 'c'), ('exit', 'b'), ('exit', 'a')]
+
+    @pytest.mark.asyncio
+    async def test_dependency_values(self, resource, events):
+        """Test that a callable added to the stack gets the values of its dependencies."""
+        async with ConcurrentExitStack() as stack:
+            conn = stack.add(resource('conn'))
+            tx = stack.add(lambda conn_value: resource(conn_value + '/tx'), depends_on=[conn])
+            stack.add(resource('cache'))
+            stack.add(lambda *values: resource('+'.join(values)), depends_on=[tx, conn])
+            assert await stack.enter() == ['conn', 'conn/tx', 'cache', 'conn/tx+conn']
+
+        assert events.index(('enter', 'conn')) < events.index(('enter', 'conn/tx'))
+        assert events.index(('exit', 'conn/tx')) < events.index(('exit', 'conn'))
+
+    @pytest.mark.asyncio
+    async def test_dependency_callable_failure(self, resource, events):
+        def fail(value):
+            raise Exception('no context for %s' % value)
+
+        stack = ConcurrentExitStack()
+        stack.add(fail, depends_on=[stack.add(resource('a'))])
+        with pytest.raises(Exception) as exc:
+            await stack.enter()
+
+        exc.match('^no context for a$')
+        assert events == [('enter', 'a'), ('exit', 'a')]
+
+    @pytest.mark.asyncio
+    async def test_setup_failure(self, resource, events):
+        stack = ConcurrentExitStack()
+        a = stack.add(resource('a'))
+        stack.add(resource('b', delay=0.01, fail=True))
+        stack.add(resource('c'), depends_on=[a])
+        stack.add(resource('d', delay=0.1), depends_on=[stack.add(resource('e', fail=True))])
+        with pytest.raises(Exception) as exc:
+            await stack.enter()
+
+        exc.match('^b failed$')
+        assert ('enter', 'd') not in events
+        assert sorted(event for event in events if event[0] == 'exit') == [
+            ('exit', 'a'), ('exit', 'c')]
+        assert events.index(('exit', 'c')) < events.index(('exit', 'a'))
+
+    @pytest.mark.asyncio
+    async def test_exception_suppression(self, resource, events):
+        async with ConcurrentExitStack() as stack:
+            await stack.enter_async_contexts(resource('a', suppress=True),
+                                             resource('b', suppress=True))
+            raise Exception('foo')
+
+        with pytest.raises(Exception) as exc:
+            async with ConcurrentExitStack() as stack:
+                await stack.enter_async_contexts(resource('a', suppress=True), resource('b'))
+                raise Exception('foo')
+
+        exc.match('^foo$')
+
+    @pytest.mark.asyncio
+    async def test_unknown_dependency(self, resource):
+        stack = ConcurrentExitStack()
+        pytest.raises(ValueError, stack.add, resource('a'), depends_on=[resource('b')])
@@ -0,0 +1,294 @@
+import asyncio
+import gc
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from threading import Event, current_thread
+
+import pytest
+
+from asyncio_extras import (
+    AdaptiveThreadPoolExecutor, call_in_executor, threadpool, set_default_executor,
+    register_executor, get_executor, get_queue_stats, open_async, read_file_async,
+    DeadlineExceeded, ExecutorOverloaded)
+from asyncio_extras import executors
+
+
+@pytest.fixture
+def executor():
+    executor = AdaptiveThreadPoolExecutor(max_workers=4, idle_timeout=0.1,
+                                          target_queue_wait=0.01)
+    yield executor
+    executor.shutdown()
+
+
+def test_submit(executor):
+    assert executor.submit(pow, 2, 3).result() == 8
+    assert executor.worker_count == 1
+    with pytest.raises(ZeroDivisionError):
+        executor.submit(divmod, 1, 0).result()
+
+
+def test_grow_and_shrink(executor):
+    futures = [executor.submit(time.sleep, 0.05) for _ in range(8)]
+    for future in futures:
+        future.result()
+
+    assert executor.worker_count == 4
+    time.sleep(0.3)
+    assert executor.worker_count == 0
+
+
+def test_no_growth_for_quick_calls(executor):
+    for _ in range(100):
+        executor.submit(pow, 2, 3).result()
+
+    assert executor.worker_count == 1
+
+
+def test_min_workers():
+    executor = AdaptiveThreadPoolExecutor(min_workers=2, max_workers=4, idle_timeout=0.05)
+    try:
+        futures = [executor.submit(time.sleep, 0.01) for _ in range(2)]
+        for future in futures:
+            future.result()
+
+        time.sleep(0.2)
+        assert executor.worker_count == 2
+    finally:
+        executor.shutdown()
+
+    assert executor.worker_count == 0
+
+
+def test_cancel_queued(executor):
+    executor.max_workers = 1
+    event = Event()
+    calls = []
+    blocker = executor.submit(event.wait)
+    future = executor.submit(calls.append, 1)
+    assert future.cancel()
+    event.set()
+    blocker.result()
+    executor.submit(calls.append, 2).result()
+    assert calls == [2]
+
+
+def test_shutdown(executor):
+    future = executor.submit(time.sleep, 0.05)
+    executor.shutdown()
+    assert future.done()
+    pytest.raises(RuntimeError, executor.submit, pow, 2, 3)
+
+
+def test_shutdown_cancel_futures(executor):
+    executor.max_workers = 1
+    event = Event()
+    executor.submit(event.wait)
+    future = executor.submit(pow, 2, 3)
+    executor.shutdown(wait=False, cancel_futures=True)
+    assert future.cancelled()
+    event.set()
+
+
+@pytest.mark.parametrize('min_workers, max_workers', [(0, 0), (3, 2), (-1, 2)])
+def test_bad_sizes(min_workers, max_workers):
+    pytest.raises(ValueError, AdaptiveThreadPoolExecutor, min_workers, max_workers)
+
+
+@pytest.mark.asyncio
+async def test_default_executor(executor):
+    @threadpool
+    def double(value):
+        return value * 2
+
+    set_default_executor(executor)
+    try:
+        assert await double(3) == 6
+        assert await call_in_executor(pow, 2, 3) == 8
+        async with threadpool():
+            pass
+    finally:
+        set_default_executor(None)
+
+    assert executor.worker_count == 1
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(executors, '_executors', {})
+    monkeypatch.setattr(executors, '_queue_limits', {})
+
+
+class TestRegistry:
+    @pytest.fixture
+    def named_executor(self, registry):
+        executor = ThreadPoolExecutor(1)
+        register_executor('named', executor)
+        yield executor
+        executor.shutdown()
+
+    def test_get_executor(self, named_executor):
+        assert get_executor('named') is named_executor
+
+    def test_unknown_name(self, registry):
+        exc = pytest.raises(LookupError, get_executor, 'foo')
+        exc.match("^no executor has been registered by the name 'foo'$")
+
+    def test_builtin_io_executor(self, registry):
+        executor = get_executor('io')
+        try:
+            assert isinstance(executor, AdaptiveThreadPoolExecutor)
+            assert get_executor('io') is executor
+        finally:
+            executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_threadpool(self, named_executor):
+        @threadpool('named')
+        def get_thread():
+            return current_thread()
+
+        # The executor has a single worker thread, so every call must run in that one
+        worker = named_executor.submit(current_thread).result()
+        assert await get_thread() is worker
+        async with threadpool('named'):
+            assert current_thread() is worker
+
+        assert await call_in_executor(get_thread, executor='named') is worker
+
+    @pytest.mark.asyncio
+    async def test_unknown_name_submit(self, registry):
+        with pytest.raises(LookupError):
+            await call_in_executor(time.sleep, 0, executor='foo')
+
+    @pytest.mark.asyncio
+    async def test_file_io_executor(self, tmpdir, registry):
+        class CountingExecutor(ThreadPoolExecutor):
+            submissions = 0
+
+            def submit(self, *args, **kwargs):
+                self.submissions += 1
+                return super().submit(*args, **kwargs)
+
+        path = tmpdir.join('testfile')
+        path.write('foo')
+        with CountingExecutor(1) as executor:
+            register_executor('io', executor)
+            assert await read_file_async(str(path), 'r') == 'foo'
+            assert executor.submissions == 1
+
+            async with open_async(str(path), 'r') as f:
+                assert await f.read() == 'foo'
+
+            assert executor.submissions == 4
+
+            async with open_async(str(path), 'r', executor=None) as f:
+                assert await f.read() == 'foo'
+
+            assert executor.submissions == 4
+
+    @pytest.mark.asyncio
+    async def test_queue_limit(self, registry):
+        event = Event()
+        with ThreadPoolExecutor(1) as executor:
+            register_executor('limited', executor, max_queued=1)
+            blocker = call_in_executor(event.wait, executor='limited')
+            await asyncio.sleep(0.05)
+            assert get_queue_stats('limited') == (0, 1, 0)
+
+            queued = call_in_executor(pow, 2, 3, executor='limited')
+            with pytest.raises(ExecutorOverloaded):
+                await call_in_executor(pow, 2, 3, executor='limited')
+
+            assert get_queue_stats('limited') == (1, 1, 1)
+            event.set()
+            await blocker
+            assert await queued == 8
+            assert get_queue_stats('limited') == (0, 1, 1)
+
+    @pytest.mark.asyncio
+    async def test_queue_limit_cancelled(self, registry):
+        event = Event()
+        with ThreadPoolExecutor(1) as executor:
+            register_executor('limited', executor, max_queued=1)
+            blocker = call_in_executor(event.wait, executor='limited')
+            queued = call_in_executor(pow, 2, 3, executor='limited')
+            queued.cancel()
+            await asyncio.sleep(0)
+            assert get_queue_stats('limited').queued == 0
+            event.set()
+            await blocker
+
+    def test_queue_stats_no_limit(self, named_executor):
+        pytest.raises(LookupError, get_queue_stats, 'named')
+
+    def test_negative_max_queued(self, registry):
+        pytest.raises(ValueError, register_executor, 'foo', ThreadPoolExecutor(1),
+                      max_queued=-1)
+
+    def test_reregister_without_limit(self, named_executor):
+        register_executor('named', named_executor, max_queued=1)
+        register_executor('named', named_executor)
+        pytest.raises(LookupError, get_queue_stats, 'named')
+
+
+class TestDeadlines:
+    @pytest.fixture
+    def executor(self):
+        executor = ThreadPoolExecutor(1)
+        yield executor
+        executor.shutdown()
+
+    @pytest.mark.parametrize('affinity', [None, 'key'])
+    @pytest.mark.asyncio
+    async def test_deadline_exceeded(self, executor, affinity):
+        event = Event()
+        calls = []
+        blocker = threadpool(executor, affinity=affinity)(event.wait)()
+        queued = threadpool(executor, affinity=affinity, deadline=0.05)(calls.append)(1)
+        with pytest.raises(DeadlineExceeded):
+            await queued
+
+        event.set()
+        await blocker
+        await call_in_executor(calls.append, 2, executor=executor)
+        assert calls == [2]
+
+    @pytest.mark.asyncio
+    async def test_deadline_met(self, executor):
+        assert await call_in_executor(time.sleep, 0.1, executor=executor, deadline=0.05) is None
+
+    @pytest.mark.asyncio
+    async def test_block_deadline_exceeded(self, executor):
+        event = Event()
+        calls = []
+        blocker = call_in_executor(event.wait, executor=executor)
+        with pytest.raises(DeadlineExceeded):
+            async with threadpool(executor, deadline=0.05):
+                calls.append(1)
+
+        event.set()
+        await blocker
+        async with threadpool(executor, deadline=0.05):
+            calls.append(2)
+
+        assert calls == [2]
+
+    @pytest.mark.asyncio
+    async def test_dispatch_failure(self, event_loop, executor):
+        """Test that a call that could not be submitted leaves no deadline timer behind."""
+        contexts = []
+        event_loop.set_exception_handler(lambda loop, context: contexts.append(context))
+        executor.shutdown()
+        with pytest.raises(RuntimeError):
+            await call_in_executor(pow, 2, 3, executor=executor, deadline=0.01)
+
+        await asyncio.sleep(0.05)
+        gc.collect()
+        assert contexts == []
+
+    @pytest.mark.asyncio
+    async def test_process_pool(self):
+        with ProcessPoolExecutor(1) as executor:
+            with pytest.raises(ValueError):
+                await call_in_executor(pow, 2, 3, executor=executor, deadline=1)
@@ -1,9 +1,19 @@
+import asyncio
+import errno
+import gc
+import os
+import shutil
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from pathlib import Path
 
 import pytest
 
-from asyncio_extras import open_async
+from asyncio_extras import (
+    open_async, BufferPool, mmap_async, read_file_async, write_file_async, copy_async,
+    sendfile_async)
 
 
 @pytest.fixture(scope='module')
@@ -35,6 +45,84 @@ async def test_write(testdatafile, testdata):
     assert testdatafile.stat().st_size == len(testdata) + 1000
 
 
+@pytest.mark.asyncio
+async def test_close_in_worker_thread(testdatafile):
+    """Test that the file is closed in a worker thread when exiting the context manager."""
+    class DummyFile:
+        def close(self):
+            nonlocal close_thread
+            close_thread = threading.current_thread()
+
+    close_thread = None
+    async with open_async(testdatafile, 'rb') as f:
+        f._raw_file.close()
+        f._raw_file = DummyFile()
+
+    assert close_thread is not None
+    assert close_thread is not threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_aclose(testdatafile):
+    f = await open_async(testdatafile, 'ab')
+    await f.write(b'foo')
+    await f.aclose()
+    assert f.closed
+    assert testdatafile.read_bytes().endswith(b'foo')
+
+
+@pytest.mark.asyncio
+async def test_tell_readinto(testdatafile, testdata):
+    buffer = bytearray(1000)
+    async with open_async(testdatafile, 'rb') as f:
+        await f.seek(500)
+        assert await f.readinto(buffer) == 1000
+        assert await f.tell() == 1500
+
+    assert buffer == testdata[500:1500]
+
+
+@pytest.mark.asyncio
+async def test_peek_readinto1(testdatafile, testdata):
+    buffer = bytearray(1000)
+    async with open_async(testdatafile, 'rb') as f:
+        assert (await f.peek(10)).startswith(testdata[:10])
+        assert await f.readinto1(buffer) == 1000
+
+    assert buffer == testdata[:1000]
+
+
+@pytest.mark.asyncio
+async def test_pread(testdatafile, testdata):
+    async with open_async(testdatafile, 'rb') as f:
+        await f.seek(100)
+        assert await f.pread(1500, 1000) == testdata[1500:2500]
+        assert await f.pread(9500, 1000) == testdata[9500:]
+        assert await f.tell() == 100
+
+
+@pytest.mark.asyncio
+async def test_pread_short_read(testdatafile, testdata, monkeypatch):
+    """Test that pread() keeps reading after a short read from os.pread()."""
+    def short_pread(fd, size, offset):
+        return real_pread(fd, min(size, 300), offset)
+
+    real_pread = os.pread
+    monkeypatch.setattr(os, 'pread', short_pread)
+    async with open_async(testdatafile, 'rb') as f:
+        assert await f.pread(1500, 1000) == testdata[1500:2500]
+        assert await f.pread(9500, 1000) == testdata[9500:]
+
+
+@pytest.mark.asyncio
+async def test_read_ranges(testdatafile, testdata):
+    ranges = [(offset, 500) for offset in range(0, 10000, 700)]
+    async with open_async(testdatafile, 'rb', executor=ThreadPoolExecutor(4)) as f:
+        results = await f.read_ranges(ranges)
+
+    assert results == [testdata[offset:offset + size] for offset, size in ranges]
+
+
 @pytest.mark.asyncio
 async def test_async_readchunks(testdatafile):
     value = 0
@@ -44,6 +132,114 @@ async def test_async_readchunks(testdatafile):
             value += 1
 
 
+@pytest.mark.parametrize('prefetch', [1, 3, 20])
+@pytest.mark.asyncio
+async def test_async_readchunks_prefetch(testdatafile, prefetch):
+    value = 0
+    async with open_async(testdatafile, 'rb') as f:
+        async for chunk in f.async_readchunks(1000, prefetch=prefetch):
+            assert chunk == bytes([value] * 1000)
+            value += 1
+
+    assert value == 10
+
+
+@pytest.mark.asyncio
+async def test_async_readchunks_prefetch_break(testdatafile):
+    """Test that breaking out of a prefetching iteration waits for the pending reads."""
+    async with open_async(testdatafile, 'rb') as f:
+        chunks = f.async_readchunks(1000, prefetch=3)
+        async for chunk in chunks:
+            assert chunk == bytes([0] * 1000)
+            break
+
+        await chunks.aclose()
+        assert await f.read(1000) == bytes([4] * 1000)
+
+
+@pytest.mark.asyncio
+async def test_async_readchunks_prefetch_break_error(event_loop, testdatafile):
+    """Test that errors from reads pending when the iteration was stopped are not reported."""
+    class FailingFile:
+        def __init__(self):
+            self.reads = 0
+
+        def read(self, size):
+            self.reads += 1
+            if self.reads > 1:
+                raise OSError('read failed')
+
+            return b'x' * size
+
+        def close(self):
+            pass
+
+    errors = []
+    event_loop.set_exception_handler(lambda loop, context: errors.append(context))
+    async with open_async(testdatafile, 'rb') as f:
+        f._raw_file.close()
+        f._raw_file = FailingFile()
+        chunks = f.async_readchunks(1000, prefetch=3)
+        async for chunk in chunks:
+            break
+
+        await chunks.aclose()
+
+    del chunks
+    gc.collect()
+    assert errors == []
+
+
+@pytest.mark.asyncio
+async def test_async_readinto_chunks(testdatafile, testdata):
+    pool = BufferPool(3000, 2)
+    buffers = set()
+    chunks = []
+    async with open_async(testdatafile, 'rb') as f:
+        async for chunk in f.async_readinto_chunks(pool):
+            assert isinstance(chunk, memoryview)
+            buffers.add(id(chunk.obj))
+            with pool.releasing(chunk):
+                chunks.append(bytes(chunk))
+
+    assert b''.join(chunks) == testdata
+    assert len(buffers) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_readinto_chunks_text_mode(testdatafile):
+    async with open_async(testdatafile, encoding='latin-1') as f:
+        with pytest.raises(TypeError):
+            async for chunk in f.async_readinto_chunks(BufferPool(1000, 1)):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_buffer_pool_wait():
+    """Test that acquire() waits for a buffer to be released when the pool is exhausted."""
+    pool = BufferPool(10, 1)
+    buffer = await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    pool.release(memoryview(buffer)[:5])
+    assert await waiter is buffer
+
+
+@pytest.mark.asyncio
+async def test_buffer_pool_cancel_waiter():
+    """Test that a cancelled waiter does not swallow a released buffer."""
+    pool = BufferPool(10, 1)
+    buffer = await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    pool.release(buffer)
+    assert await pool.acquire() is buffer
+
+
 @pytest.mark.asyncio
 async def test_no_contextmanager(testdatafile, testdata):
     """Test that open_async() can be used without an async context manager."""
@@ -62,3 +258,253 @@ async def test_iteration(testdatafile, testdata):
 
     data = b''.join(lines)
     assert data == testdata
+
+
+@pytest.mark.parametrize('buffer_size', [1, 10, 65536])
+@pytest.mark.asyncio
+async def test_async_iterlines(testdatafile, buffer_size):
+    testdatafile.write_bytes('åäö\r\nfoo\rbar\n\nbaz'.encode('utf-8'))
+    async with open_async(testdatafile, encoding='utf-8') as f:
+        lines = []
+        async for line in f.async_iterlines(buffer_size):
+            lines.append(line)
+
+    assert lines == ['åäö\n', 'foo\n', 'bar\n', '\n', 'baz']
+
+
+@pytest.mark.asyncio
+async def test_async_iterlines_unopened(testdatafile, testdata):
+    """Test that async_iterlines() opens the file if it has not been opened yet."""
+    lines = []
+    f = open_async(testdatafile, 'rb')
+    async for line in f.async_iterlines(100):
+        lines.append(line)
+
+    await f.aclose()
+
+    assert b''.join(lines) == testdata
+
+
+@pytest.mark.asyncio
+async def test_affinity(testdatafile):
+    """Test that operations on a file opened with affinity=True are run in the call order."""
+    async with open_async(testdatafile, 'wb', affinity=True) as f:
+        await asyncio.gather(*[f.write(bytes([i])) for i in range(100)])
+
+    assert testdatafile.read_bytes() == bytes(range(100))
+
+
+class TestBufferedWriter:
+    @pytest.mark.asyncio
+    async def test_write(self, testdatafile):
+        async with open_async(testdatafile, 'wb') as f:
+            async with f.buffered_writer(100) as writer:
+                for i in range(250):
+                    assert await writer.write(bytes([i])) == 1
+
+                await asyncio.sleep(0.1)
+                assert testdatafile.stat().st_size == 200
+
+        assert testdatafile.read_bytes() == bytes(range(250))
+
+    @pytest.mark.asyncio
+    async def test_flush_interval(self, testdatafile):
+        async with open_async(testdatafile, 'w') as f:
+            writer = f.buffered_writer(flush_interval=0.05)
+            await writer.write('foo')
+            await writer.write('bar')
+            assert testdatafile.read_text() == ''
+            await asyncio.sleep(0.2)
+            assert testdatafile.read_text() == 'foobar'
+
+    @pytest.mark.asyncio
+    async def test_write_error(self, testdatafile):
+        """Test that errors from writing a batch in the background are raised later."""
+        async with open_async(testdatafile, 'rb') as f:
+            writer = f.buffered_writer(1)
+            await writer.write(b'foo')
+            with pytest.raises(OSError):
+                await writer.flush()
+
+
+class TestMappedFile:
+    @pytest.mark.asyncio
+    async def test_view(self, testdatafile, testdata):
+        async with mmap_async(testdatafile) as f:
+            assert len(f) == len(testdata)
+            with f.view(1500, 1000) as view:
+                assert view.tobytes() == testdata[1500:2500]
+
+            with f.view(9500) as view:
+                assert view.tobytes() == testdata[9500:]
+
+        assert f.closed
+
+    @pytest.mark.asyncio
+    async def test_read(self, testdatafile, testdata):
+        async with mmap_async(testdatafile) as f:
+            with await f.read(4000, 7000) as view:
+                assert view.tobytes() == testdata[4000:]
+
+            await f.prefetch()
+
+    @pytest.mark.asyncio
+    async def test_no_contextmanager(self, testdatafile, testdata):
+        f = await mmap_async(testdatafile)
+        with f.view() as view:
+            assert view.tobytes() == testdata
+
+        f.close()
+        assert f.closed
+
+    @pytest.mark.asyncio
+    async def test_empty_file(self, tmpdir):
+        path = tmpdir.join('empty')
+        path.write(b'')
+        async with mmap_async(str(path)) as f:
+            assert len(f) == 0
+            with f.view() as view:
+                assert view.tobytes() == b''
+
+            with await f.read() as view:
+                assert view.tobytes() == b''
+
+        assert f.closed
+
+
+class TestWholeFile:
+    @pytest.mark.asyncio
+    async def test_read_file(self, testdatafile, testdata):
+        assert await read_file_async(testdatafile) == testdata
+
+    @pytest.mark.asyncio
+    async def test_read_file_text(self, testdatafile):
+        testdatafile.write_bytes('åäö\r\n'.encode('utf-8'))
+        assert await read_file_async(testdatafile, 'r', encoding='utf-8') == 'åäö\n'
+
+    @pytest.mark.parametrize('atomic', [False, True])
+    @pytest.mark.asyncio
+    async def test_write_file(self, testdatafile, atomic):
+        testdatafile.chmod(0o640)
+        assert await write_file_async(testdatafile, b'foo', atomic=atomic) == 3
+        assert testdatafile.read_bytes() == b'foo'
+        assert testdatafile.stat().st_mode & 0o777 == 0o640
+        assert os.listdir(str(testdatafile.parent)) == [testdatafile.name]
+
+    @pytest.mark.asyncio
+    async def test_write_file_text_append(self, testdatafile, testdata):
+        await write_file_async(testdatafile, 'åäö', 'a', encoding='utf-8')
+        assert testdatafile.read_bytes() == testdata + 'åäö'.encode('utf-8')
+
+    @pytest.mark.asyncio
+    async def test_write_file_atomic_new(self, tmpdir):
+        path = tmpdir.join('newfile')
+        await write_file_async(str(path), 'foo', 'w', atomic=True)
+        assert path.read() == 'foo'
+
+    @pytest.mark.asyncio
+    async def test_write_file_atomic_failure(self, testdatafile, testdata):
+        """Test that a failed atomic write leaves the original file and no temporary files."""
+        with pytest.raises(TypeError):
+            await write_file_async(testdatafile, 'foo', atomic=True)
+
+        assert testdatafile.read_bytes() == testdata
+        assert os.listdir(str(testdatafile.parent)) == [testdatafile.name]
+
+    @pytest.mark.asyncio
+    async def test_write_file_atomic_append(self, testdatafile):
+        with pytest.raises(ValueError):
+            await write_file_async(testdatafile, b'foo', 'ab', atomic=True)
+
+
+class TestCopy:
+    @pytest.fixture(params=['kernel', 'chunked'])
+    def copy_mode(self, request, monkeypatch):
+        if request.param == 'chunked':
+            def unsupported(*args):
+                raise OSError(errno.ENOSYS, 'not supported')
+
+            monkeypatch.setattr(os, 'copy_file_range', unsupported, raising=False)
+            monkeypatch.setattr(os, 'sendfile', unsupported, raising=False)
+
+        return request.param
+
+    @pytest.mark.asyncio
+    async def test_copy(self, testdatafile, testdata, copy_mode):
+        progress = []
+        dst = testdatafile.with_name('copy')
+        copied = await copy_async(testdatafile, dst, chunk_size=3000,
+                                  progress=lambda *args: progress.append(args))
+        assert copied == len(testdata)
+        assert dst.read_bytes() == testdata
+        assert progress == [(3000, 10000), (6000, 10000), (9000, 10000), (10000, 10000)]
+
+    @pytest.mark.asyncio
+    async def test_copy_empty(self, tmpdir, copy_mode):
+        src = tmpdir.join('empty')
+        src.write(b'')
+        assert await copy_async(str(src), str(tmpdir.join('copy'))) == 0
+        assert tmpdir.join('copy').read() == ''
+
+    @pytest.mark.asyncio
+    async def test_copy_same_file(self, testdatafile, testdata):
+        link = testdatafile.with_name('link')
+        os.link(str(testdatafile), str(link))
+        for dst in (testdatafile, link):
+            with pytest.raises(shutil.SameFileError):
+                await copy_async(testdatafile, dst)
+
+        assert testdatafile.read_bytes() == testdata
+
+    @pytest.mark.parametrize('offset, count', [(0, None), (1500, 5000)])
+    @pytest.mark.asyncio
+    async def test_sendfile(self, event_loop, tmpdir, copy_mode, offset, count):
+        data = os.urandom(3000000)
+        path = tmpdir.join('data')
+        path.write(data, 'wb')
+        progress = []
+        expected = data[offset:] if count is None else data[offset:offset + count]
+        sock1, sock2 = socket.socketpair()
+        sock1.setblocking(False)
+        sock2.setblocking(False)
+        with sock1, sock2:
+            future = asyncio.ensure_future(
+                sendfile_async(str(path), sock1, offset, count, chunk_size=100000,
+                               progress=lambda *args: progress.append(args)))
+            received = bytearray()
+            while len(received) < len(expected):
+                received += await event_loop.sock_recv(sock2, 1048576)
+
+            assert await future == len(expected)
+
+        assert received == expected
+        assert progress[-1] == (len(expected), len(expected))
+
+    @pytest.mark.skipif(os.name != 'posix', reason='requires fcntl')
+    @pytest.mark.asyncio
+    async def test_sendfile_high_fd(self, event_loop, tmpdir, copy_mode):
+        """Test that sockets with file descriptors above FD_SETSIZE can be waited on."""
+        import fcntl
+        import resource
+
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 1100:
+            pytest.skip('the open file limit is too low')
+
+        data = os.urandom(3000000)
+        path = tmpdir.join('data')
+        path.write(data, 'wb')
+        sock1, sock2 = socket.socketpair()
+        high_fd = fcntl.fcntl(sock1.fileno(), fcntl.F_DUPFD, 1100)
+        sock1.close()
+        sock1 = socket.socket(fileno=high_fd)
+        sock1.setblocking(False)
+        sock2.setblocking(False)
+        with sock1, sock2:
+            future = asyncio.ensure_future(sendfile_async(str(path), sock1))
+            received = bytearray()
+            while len(received) < len(data):
+                received += await asyncio.wait_for(event_loop.sock_recv(sock2, 1048576), 5)
+
+            assert await future == len(data)
+
+        assert received == data
@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from asyncio_extras import (
+    threadpool, call_in_executor, call_in_process, open_async, ExecutorMetrics,
+    add_executor_listener, remove_executor_listener)
+
+
+def sleeper(delay):
+    time.sleep(delay)
+
+
+@pytest.fixture
+def records():
+    records = []
+    add_executor_listener(records.append)
+    yield records
+    remove_executor_listener(records.append)
+
+
+@pytest.mark.asyncio
+async def test_call_in_executor(records):
+    executor = ThreadPoolExecutor(1)
+    await call_in_executor(sleeper, 0.1, executor=executor)
+    assert len(records) == 1
+    record = records[0]
+    assert record.call_site == __name__ + '.sleeper'
+    assert record.executor is executor
+    assert record.submitted <= record.started <= record.finished
+    assert record.run_time >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_queue_wait(records):
+    """Test that the time spent waiting for a free worker thread is recorded as queue wait."""
+    executor = ThreadPoolExecutor(1)
+    first = call_in_executor(sleeper, 0.1, executor=executor)
+    await call_in_executor(sleeper, 0, executor=executor)
+    await first
+    assert len(records) == 2
+    assert records[1].queue_wait >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_threadpool_block(records):
+    async with threadpool():
+        pass
+
+    assert len(records) == 1
+    filename, lineno = records[0].call_site.rsplit(':', 1)
+    assert filename == __file__
+    assert int(lineno) > 0
+
+
+@pytest.mark.asyncio
+async def test_file_operations(records, tmpdir):
+    async with open_async(str(tmpdir.join('file')), 'wb') as f:
+        await f.write(b'foo')
+
+    assert [record.call_site.rsplit('.', 1)[-1] for record in records] == \
+        ['open', 'write', 'close']
+
+
+@pytest.mark.asyncio
+async def test_call_in_process():
+    """Test that calls to process pools are reported without sending listeners to the worker."""
+    metrics = ExecutorMetrics()
+    add_executor_listener(metrics)
+    try:
+        await call_in_process(sleeper, 0.1)
+    finally:
+        remove_executor_listener(metrics)
+
+    stats = metrics.summary()[__name__ + '.sleeper']
+    assert stats['count'] == 1
+    assert stats['queue_wait'][100] == 0
+    assert stats['run_time'][100] >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_failing_listener(records):
+    """Test that an exception from a listener does not affect the call or other listeners."""
+    def fail(record):
+        raise Exception('foo')
+
+    add_executor_listener(fail)
+    try:
+        assert await call_in_executor(str, 1) == '1'
+    finally:
+        remove_executor_listener(fail)
+
+    assert len(records) == 1
+
+
+@pytest.mark.asyncio
+async def test_removed_listener():
+    records = []
+    add_executor_listener(records.append)
+    remove_executor_listener(records.append)
+    await call_in_executor(str, 1)
+    assert not records
+
+
+@pytest.mark.asyncio
+async def test_metrics():
+    metrics = ExecutorMetrics(max_samples=5)
+    add_executor_listener(metrics)
+    try:
+        for _ in range(10):
+            await call_in_executor(sleeper, 0)
+
+        await call_in_executor(sleeper, 0.1)
+    finally:
+        remove_executor_listener(metrics)
+
+    summary = metrics.summary((50, 100))
+    stats = summary[__name__ + '.sleeper']
+    assert stats['count'] == 11
+    assert stats['run_time'][50] < 0.1
+    assert stats['run_time'][100] >= 0.1
+    assert set(stats['queue_wait']) == {50, 100}
+
+    metrics.reset()
+    assert metrics.summary() == {}
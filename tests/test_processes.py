@@ -0,0 +1,133 @@
+import asyncio
+import gc
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+import pytest
+
+from asyncio_extras import processpool, call_in_process, processes
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7 and earlier
+    shared_memory = None
+
+requires_shared_memory = pytest.mark.skipif(
+    shared_memory is None or os.name != 'posix',
+    reason='shared memory results require Python 3.8 or later on a POSIX system')
+
+
+def get_pid(offset=0):
+    return os.getpid() + offset
+
+
+def get_lock():
+    return Lock()
+
+
+def make_bytes(size, delay=0):
+    time.sleep(delay)
+    return b'x' * size
+
+
+@processpool
+def get_pid_default(offset=0):
+    return os.getpid() + offset
+
+
+@processpool(ProcessPoolExecutor(1))
+def get_pid_custom(offset=0):
+    return os.getpid() + offset
+
+
+class TestCallInProcess:
+    @pytest.mark.parametrize('executor', [None, ProcessPoolExecutor(1)], ids=['default', 'custom'])
+    @pytest.mark.asyncio
+    async def test_call(self, executor):
+        pid = await call_in_process(get_pid, 1, executor=executor)
+        assert pid - 1 != os.getpid()
+
+    @pytest.mark.asyncio
+    async def test_workers_kept_running(self):
+        """Test that the default executor reuses its worker processes."""
+        executor_pids = set()
+        for _ in range(20):
+            executor_pids.add(await call_in_process(get_pid))
+
+        assert len(executor_pids) <= os.cpu_count()
+
+    @pytest.mark.asyncio
+    async def test_unpicklable_function(self):
+        with pytest.raises(TypeError) as exc:
+            await call_in_process(lambda: None)
+
+        exc.match('cannot send .+ to a worker process')
+
+    @pytest.mark.asyncio
+    async def test_unpicklable_argument(self):
+        with pytest.raises(TypeError) as exc:
+            await call_in_process(get_pid, Lock())
+
+        exc.match('cannot send .+ to a worker process')
+
+    @pytest.mark.asyncio
+    async def test_unpicklable_return_value(self):
+        with pytest.raises(TypeError) as exc:
+            await call_in_process(get_lock)
+
+        exc.match('the return value of .+ could not be pickled')
+
+    @pytest.mark.parametrize('threshold', [
+        None,
+        pytest.param(1000, marks=requires_shared_memory),
+        pytest.param(1000000, marks=requires_shared_memory)
+    ])
+    @pytest.mark.asyncio
+    async def test_shared_memory(self, threshold):
+        assert await call_in_process(make_bytes, 100000,
+                                     shared_memory_threshold=threshold) == b'x' * 100000
+
+    @requires_shared_memory
+    @pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='requires /dev/shm')
+    @pytest.mark.asyncio
+    async def test_shared_memory_cancelled(self):
+        """Test that the memory block is unlinked when the awaiting task has been cancelled."""
+        with ProcessPoolExecutor(1) as executor:
+            await call_in_process(get_pid, executor=executor)  # start the worker process
+            blocks_before = set(os.listdir('/dev/shm'))
+            task = asyncio.ensure_future(call_in_process(make_bytes, 100000, 0.2,
+                                                         executor=executor,
+                                                         shared_memory_threshold=1000))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await asyncio.sleep(0.3)
+
+        gc.collect()
+        assert set(os.listdir('/dev/shm')) - blocks_before == set()
+
+
+class TestProcesspool:
+    @pytest.mark.asyncio
+    async def test_decorator_noargs(self):
+        assert await get_pid_default(1) - 1 != os.getpid()
+
+    @pytest.mark.asyncio
+    async def test_decorator(self):
+        assert await get_pid_custom(offset=1) - 1 != os.getpid()
+
+    def test_worker_sees_event_loop(self, monkeypatch):
+        """
+        Test that the wrapped function is called directly in the worker process even if an event
+        loop appears to be running there, as in forked workers on older Python versions.
+
+        """
+        monkeypatch.setattr(processes, '_get_running_loop', lambda: object())
+        payload = pickle.dumps((get_pid_default, (1,), {}))
+        assert pickle.loads(processes._run_pickled(payload, None)) == os.getpid() + 1
+
+    def test_no_event_loop(self):
+        """Test that the wrapped function is called directly when no event loop is running."""
+        assert get_pid_default() == os.getpid()
@@ -1,14 +1,18 @@
 import asyncio
 import threading
+from functools import partial
 from asyncio.futures import Future
 from concurrent.futures.thread import ThreadPoolExecutor
 from threading import current_thread, main_thread
 
 import pytest
 import time
+from async_generator import async_generator, yield_
 
-from asyncio_extras import threadpool, call_in_executor
-from asyncio_extras.threads import call_async
+from asyncio_extras import (
+    async_contextmanager, threadpool, call_in_executor, map_in_executor, iterate_in_executor,
+    get_cancel_token)
+from asyncio_extras.threads import call_async, call_async_batch, LoopPortal
 
 
 class TestThreadpool:
@@ -93,6 +97,89 @@ class TestThreadpool:
         coros = [sleeper() for _ in range(10)]
         await asyncio.gather(*coros)
 
+    @pytest.mark.asyncio
+    async def test_threadpool_nested_coroutine(self, monkeypatch):
+        """
+        Test that "async with threadpool()" works in a coroutine awaited by another coroutine,
+        without scanning the heap for the coroutine object.
+
+        """
+        async def inner():
+            async with threadpool():
+                worker_thread = threading.current_thread()
+
+            return worker_thread
+
+        async def outer():
+            worker_thread = await inner()
+            return worker_thread, threading.current_thread()
+
+        monkeypatch.setattr('gc.get_referrers', None)
+        event_loop_thread = threading.current_thread()
+        worker_thread, outer_thread = await outer()
+        assert worker_thread is not event_loop_thread
+        assert outer_thread is event_loop_thread
+
+    @pytest.mark.asyncio
+    async def test_threadpool_affinity(self):
+        """
+        Test that calls with the same affinity key run on the same thread in submission order,
+        while other work can still use the rest of the executor.
+
+        """
+        executor = ThreadPoolExecutor(4)
+
+        @threadpool(executor, affinity='foo')
+        def pinned(i):
+            time.sleep(0.01)
+            results.append((i, threading.current_thread()))
+
+        @threadpool(executor)
+        def unpinned():
+            return threading.current_thread()
+
+        results = []
+        pinned_futures = [pinned(i) for i in range(10)]
+        unpinned_thread = await unpinned()
+        await asyncio.gather(*pinned_futures)
+        assert [i for i, _ in results] == list(range(10))
+        assert len({thread for _, thread in results}) == 1
+        assert unpinned_thread is not results[0][1]
+
+    @pytest.mark.asyncio
+    async def test_threadpool_contextmanager_affinity(self):
+        """Test that threadpool blocks with the same affinity key are run in FIFO order."""
+        async def run_block(i):
+            async with threadpool(executor, affinity='foo'):
+                time.sleep(0.01)
+                results.append(i)
+
+        executor = ThreadPoolExecutor(4)
+        results = []
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.ensure_future(run_block(i)))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        assert results == list(range(5))
+
+    @pytest.mark.asyncio
+    async def test_threadpool_affinity_exception(self):
+        """Test that an exception does not stop the rest of the calls for the same key."""
+        @threadpool(affinity='foo')
+        def func(fail):
+            if fail:
+                raise ValueError('foo')
+
+            return 'bar'
+
+        failing, succeeding = func(True), func(False)
+        with pytest.raises(ValueError):
+            await failing
+
+        assert await succeeding == 'bar'
+
 
 @pytest.mark.parametrize('executor', [None, ThreadPoolExecutor(1)])
 @pytest.mark.asyncio
@@ -102,6 +189,287 @@ async def test_call_in_executor(executor):
                                       executor=executor)
 
 
+class TestCancellation:
+    @pytest.fixture
+    def executor(self):
+        executor = ThreadPoolExecutor(1)
+        yield executor
+        executor.shutdown()
+
+    @pytest.mark.parametrize('affinity', [None, 'key'])
+    @pytest.mark.asyncio
+    async def test_queued_call_dropped(self, executor, affinity):
+        event = threading.Event()
+        calls = []
+        blocker = threadpool(executor, affinity=affinity)(event.wait)()
+        task = asyncio.ensure_future(threadpool(executor, affinity=affinity)(calls.append)(1))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+        event.set()
+        await blocker
+        await call_in_executor(calls.append, 2, executor=executor)
+        assert calls == [2]
+
+    @pytest.mark.asyncio
+    async def test_cancel_token(self, executor):
+        def wait_for_cancel():
+            token = get_cancel_token()
+            started.set()
+            while not token.cancelled:
+                time.sleep(0.01)
+
+            cancelled.set()
+
+        started = threading.Event()
+        cancelled = threading.Event()
+        task = asyncio.ensure_future(call_in_executor(wait_for_cancel, executor=executor))
+        await asyncio.get_event_loop().run_in_executor(None, started.wait)
+        assert not task.done()
+        task.cancel()
+        assert await asyncio.get_event_loop().run_in_executor(None, cancelled.wait, 5)
+
+    def test_cancel_token_outside_executor(self):
+        token = get_cancel_token()
+        assert not token.cancelled
+        token.raise_if_cancelled()
+        token.cancel()
+        pytest.raises(asyncio.CancelledError, token.raise_if_cancelled)
+
+    @pytest.mark.asyncio
+    async def test_queued_block_dropped(self, executor):
+        async def run_block():
+            async with threadpool(executor):
+                calls.append(1)
+
+        event = threading.Event()
+        calls = []
+        blocker = call_in_executor(event.wait, executor=executor)
+        task = asyncio.ensure_future(run_block())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+        event.set()
+        await blocker
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await call_in_executor(calls.append, 2, executor=executor)
+        assert calls == [2]
+
+    @pytest.mark.asyncio
+    async def test_running_block(self, executor):
+        async def run_block():
+            async with threadpool(executor):
+                token = get_cancel_token()
+                started.set()
+                while not token.cancelled:
+                    time.sleep(0.01)
+
+                events.append('block finished')
+
+            events.append('after block')
+
+        started = threading.Event()
+        events = []
+        task = asyncio.ensure_future(run_block())
+        await asyncio.get_event_loop().run_in_executor(None, started.wait)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert events == ['block finished']
+
+
+class TestMapInExecutor:
+    @pytest.mark.parametrize('chunksize', [1, 3, 100])
+    @pytest.mark.asyncio
+    async def test_ordered(self, chunksize):
+        def func(x):
+            time.sleep(0.001 * (x % 3))
+            return x * 2
+
+        results = []
+        async for result in map_in_executor(func, range(20), max_concurrency=4,
+                                            chunksize=chunksize):
+            results.append(result)
+
+        assert results == [x * 2 for x in range(20)]
+
+    @pytest.mark.asyncio
+    async def test_unordered(self):
+        def func(x):
+            time.sleep(0.05 if x == 0 else 0)
+            return x
+
+        results = []
+        async for result in map_in_executor(func, range(5), executor=ThreadPoolExecutor(5),
+                                            ordered=False):
+            results.append(result)
+
+        assert sorted(results) == list(range(5))
+        assert results[-1] == 0
+
+    @pytest.mark.asyncio
+    async def test_async_iterable(self):
+        @async_generator
+        async def generate():
+            for i in range(5):
+                await asyncio.sleep(0)
+                await yield_(i)
+
+        results = []
+        async for result in map_in_executor(str, generate(), chunksize=2):
+            results.append(result)
+
+        assert results == ['0', '1', '2', '3', '4']
+
+    @pytest.mark.asyncio
+    async def test_max_concurrency(self):
+        """
+        Test that no more than max_concurrency calls are in progress at any time, and that items
+        are only taken from the iterable as needed.
+
+        """
+        def func(x):
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+
+        def generate():
+            for i in range(20):
+                consumed.append(i)
+                yield i
+
+        lock = threading.Lock()
+        running = max_running = 0
+        consumed = []
+        received = 0
+        async for _ in map_in_executor(func, generate(), executor=ThreadPoolExecutor(10),
+                                       max_concurrency=3):
+            received += 1
+            assert len(consumed) <= received + 3
+
+        assert max_running <= 3
+
+    @pytest.mark.asyncio
+    async def test_exception(self):
+        def func(x):
+            if x == 3:
+                raise ValueError('foo')
+
+            return x
+
+        results = []
+        with pytest.raises(ValueError):
+            async for result in map_in_executor(func, range(10)):
+                results.append(result)
+
+        assert results == [0, 1, 2]
+
+    @pytest.mark.parametrize('kwargs', [{'max_concurrency': 0}, {'chunksize': 0}],
+                             ids=['max_concurrency', 'chunksize'])
+    @pytest.mark.asyncio
+    async def test_bad_arguments(self, kwargs):
+        with pytest.raises(ValueError) as exc:
+            async for _ in map_in_executor(str, range(10), **kwargs):
+                pass
+
+        exc.match('^{} must be at least 1$'.format(*kwargs))
+
+
+class TestIterateInExecutor:
+    @pytest.mark.parametrize('batch_size', [1, 3, 100])
+    @pytest.mark.asyncio
+    async def test_iterate(self, batch_size):
+        def generate():
+            for i in range(10):
+                threads.add(current_thread())
+                yield i
+
+        threads = set()
+        items = []
+        async for item in iterate_in_executor(generate(), batch_size=batch_size):
+            items.append(item)
+
+        assert items == list(range(10))
+        assert len(threads) == 1
+        assert current_thread() not in threads
+
+    @pytest.mark.asyncio
+    async def test_backpressure(self):
+        """Test that the worker thread stops when the queue is full."""
+        def generate():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        produced = []
+        iterator = iterate_in_executor(generate(), batch_size=2, queue_size=3)
+        assert await iterator.__anext__() == 0
+        await asyncio.sleep(0.1)
+        assert len(produced) <= 10
+        await iterator.aclose()
+
+    @pytest.mark.asyncio
+    async def test_early_exit(self):
+        """Test that the generator is closed in the worker thread when the consumer stops."""
+        def generate():
+            try:
+                yield from range(100)
+            finally:
+                nonlocal close_thread
+                close_thread = current_thread()
+
+        close_thread = None
+        iterator = iterate_in_executor(generate())
+        async for item in iterator:
+            if item == 5:
+                break
+
+        await iterator.aclose()
+        assert close_thread is not None
+        assert close_thread is not current_thread()
+
+    @pytest.mark.asyncio
+    async def test_exception(self):
+        def generate():
+            yield 1
+            yield 2
+            raise ValueError('foo')
+
+        items = []
+        with pytest.raises(ValueError) as exc:
+            async for item in iterate_in_executor(generate(), batch_size=5):
+                items.append(item)
+
+        assert items == [1, 2]
+        assert str(exc.value) == 'foo'
+
+    @pytest.mark.asyncio
+    async def test_not_iterable(self):
+        with pytest.raises(TypeError):
+            async for _ in iterate_in_executor(1):
+                pass
+
+    @pytest.mark.asyncio
+    async def test_iter_exception(self):
+        class BrokenIterable:
+            def __iter__(self):
+                raise ValueError('foo')
+
+        with pytest.raises(ValueError) as exc:
+            async for _ in iterate_in_executor(BrokenIterable()):
+                pass
+
+        assert str(exc.value) == 'foo'
+
+
 class TestCallAsync:
     @pytest.mark.asyncio
     async def test_call_async_plain(self, event_loop):
@@ -142,3 +510,144 @@ class TestCallAsync:
     async def test_call_async_from_event_loop_thread(self, event_loop):
         exc = pytest.raises(RuntimeError, call_async, event_loop, lambda: None)
         exc.match(r'call_async\(\) must not be called from an event loop thread')
+
+
+class TestCallAsyncBatch:
+    @pytest.mark.asyncio
+    async def test_call_async_batch(self, event_loop):
+        async def add_async(x, y):
+            await asyncio.sleep(0.1)
+            return x + y
+
+        def add(x, y):
+            assert current_thread() is event_loop_thread
+            return x + y
+
+        def runs_in_worker_thread():
+            return call_async_batch(event_loop, [partial(add, 1, 2), partial(add_async, 3, 4),
+                                                 partial(add, 5, 6)])
+
+        event_loop_thread = current_thread()
+        assert await event_loop.run_in_executor(None, runs_in_worker_thread) == [3, 7, 11]
+
+    @pytest.mark.asyncio
+    async def test_call_async_batch_exception(self, event_loop):
+        """Test that the exception from the first failing call is raised after all calls."""
+        async def fail_async(message):
+            await asyncio.sleep(0.1)
+            raise ValueError(message)
+
+        def fail(message):
+            raise ValueError(message)
+
+        def succeed():
+            calls.append(None)
+
+        calls = []
+        funcs = [succeed, partial(fail_async, 'foo'), partial(fail, 'bar'), succeed]
+        with pytest.raises(ValueError) as exc:
+            await event_loop.run_in_executor(None, call_async_batch, event_loop, funcs)
+
+        assert str(exc.value) == 'foo'
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_call_async_batch_empty(self, event_loop):
+        assert await event_loop.run_in_executor(None, call_async_batch, event_loop, []) == []
+
+    @pytest.mark.asyncio
+    async def test_call_async_batch_from_event_loop_thread(self, event_loop):
+        exc = pytest.raises(RuntimeError, call_async_batch, event_loop, [])
+        exc.match(r'call_async_batch\(\) must not be called from an event loop thread')
+
+
+class TestLoopPortal:
+    @pytest.mark.parametrize('batch_size', [1, 3, 100])
+    @pytest.mark.asyncio
+    async def test_iterate(self, event_loop, batch_size):
+        @async_generator
+        async def generate():
+            for i in range(10):
+                assert current_thread() is event_loop_thread
+                await asyncio.sleep(0)
+                await yield_(i)
+
+        def runs_in_worker_thread():
+            portal = LoopPortal(event_loop)
+            return list(portal.iterate(generate(), batch_size))
+
+        event_loop_thread = current_thread()
+        items = await event_loop.run_in_executor(None, runs_in_worker_thread)
+        assert items == list(range(10))
+
+    @pytest.mark.asyncio
+    async def test_iterate_exception(self, event_loop):
+        @async_generator
+        async def generate():
+            await yield_(1)
+            raise ValueError('foo')
+
+        def runs_in_worker_thread():
+            for item in LoopPortal(event_loop).iterate(generate()):
+                items.append(item)
+
+        items = []
+        with pytest.raises(ValueError):
+            await event_loop.run_in_executor(None, runs_in_worker_thread)
+
+        assert items == [1]
+
+    @pytest.mark.asyncio
+    async def test_iterate_early_exit(self, event_loop):
+        """Test that stopping the iteration early closes the asynchronous generator."""
+        @async_generator
+        async def generate():
+            nonlocal closed
+            try:
+                for i in range(100):
+                    await yield_(i)
+            finally:
+                closed = True
+
+        def runs_in_worker_thread():
+            for item in LoopPortal(event_loop).iterate(generate(), 10):
+                if item == 15:
+                    break
+
+        closed = False
+        await event_loop.run_in_executor(None, runs_in_worker_thread)
+        assert closed
+
+    @pytest.mark.asyncio
+    async def test_enter(self, event_loop):
+        @async_contextmanager
+        @async_generator
+        async def dummycontext(value):
+            events.append('enter')
+            try:
+                await yield_(value)
+            except ValueError:
+                events.append('exception')
+            else:
+                events.append('exit')
+
+        def runs_in_worker_thread():
+            portal = LoopPortal(event_loop)
+            with portal.enter(dummycontext(1)) as value:
+                events.append(value)
+
+            with portal.enter(dummycontext(2)):
+                raise ValueError('foo')
+
+        events = []
+        await event_loop.run_in_executor(None, runs_in_worker_thread)
+        assert events == ['enter', 1, 'exit', 'enter', 'exception']
+
+    @pytest.mark.asyncio
+    async def test_call(self, event_loop):
+        async def add(x, y):
+            await asyncio.sleep(0)
+            return x + y
+
+        portal = LoopPortal(event_loop)
+        assert await event_loop.run_in_executor(None, portal.call, add, 1, 2) == 3